@@ -0,0 +1,100 @@
+# Consolidated, memory-mappable dataset container ("array" recordFormat).
+# One preallocated float32 audio matrix, one parameter matrix and a small JSON header, instead of a file pair per chunk.
+import json
+import os
+
+import numpy as np
+
+def arrayColumns(paramArr):
+    '''Parameter matrix columns: a user and a synth column per swept param, then the chunk and example ids'''
+    columns = []
+    for p in paramArr:
+        columns.append("user_" + p["synth_pname"])
+        columns.append("synth_" + p["synth_pname"])
+    return columns + ["chunk", "example"]
+
+class arrayWriter():
+    '''
+        Writes chunk rows into audio<suffix>.npy (numRecords x chunkSamples, float32, zero padded) and
+        params<suffix>.npy (numRecords x columns, float64), both preallocated and memory-mapped, and describes them
+        in array<suffix>.json. With resume, existing matrices with the same layout are reopened and kept
+        (self.reused); otherwise they are allocated afresh.
+    '''
+
+    def __init__(self, outputpath, suffix, numRecords, chunkSamples, sr, paramArr, fixedParams, layout, resume=False):
+
+        self.header = {
+            "numRecords": numRecords,
+            "chunkSamples": chunkSamples,
+            "sr": sr,
+            "columns": arrayColumns(paramArr),
+            "params": paramArr,
+            "fixedParams": fixedParams,
+            "layout": layout,
+            "audio": "audio" + suffix + ".npy",
+            "paramMatrix": "params" + suffix + ".npy",
+        }
+        self.headerPath = os.path.join(outputpath, "array" + suffix + ".json")
+        self.audioPath = os.path.join(outputpath, self.header["audio"])
+        self.paramPath = os.path.join(outputpath, self.header["paramMatrix"])
+        numColumns = len(self.header["columns"])
+
+        self.reused = False
+        if resume and os.path.isfile(self.headerPath) and os.path.isfile(self.audioPath) and os.path.isfile(self.paramPath):
+            with open(self.headerPath) as f:
+                previous = json.load(f)
+            if previous["layout"] == layout and previous["numRecords"] == numRecords and previous["chunkSamples"] == chunkSamples:
+                self.audio = np.load(self.audioPath, mmap_mode="r+")
+                self.paramMatrix = np.load(self.paramPath, mmap_mode="r+")
+                self.reused = True
+
+        if not self.reused:
+            self.audio = np.lib.format.open_memmap(self.audioPath, mode="w+", dtype=np.float32, shape=(numRecords, chunkSamples))
+            self.paramMatrix = np.lib.format.open_memmap(self.paramPath, mode="w+", dtype=np.float64, shape=(numRecords, numColumns))
+        with open(self.headerPath, "w") as f:
+            json.dump(self.header, f, indent=1)
+
+    def add(self, row, sig, userP, synthP, chunk, example):
+        n = min(len(sig), self.header["chunkSamples"])
+        self.audio[row, :n] = sig[:n]
+        self.audio[row, n:] = 0
+        values = []
+        for pnum in range(len(userP)):
+            values.append(userP[pnum])
+            values.append(synthP[pnum])
+        self.paramMatrix[row] = values + [chunk, example]
+
+    def close(self):
+        self.audio.flush()
+        self.paramMatrix.flush()
+        del self.audio
+        del self.paramMatrix
+
+class arrayDataset():
+    '''
+        Reader for an "array" dataset. Rows are zero-copy views into the memory-mapped matrices:
+        ds[i] or ds[a:b] returns (audio, params), and query() selects rows by parameter range.
+    '''
+
+    def __init__(self, outputpath, suffix=""):
+
+        with open(os.path.join(outputpath, "array" + suffix + ".json")) as f:
+            self.header = json.load(f)
+        self.audio = np.load(os.path.join(outputpath, self.header["audio"]), mmap_mode="r")
+        self.paramMatrix = np.load(os.path.join(outputpath, self.header["paramMatrix"]), mmap_mode="r")
+        self.columns = self.header["columns"]
+
+    def __len__(self):
+        return self.header["numRecords"]
+
+    def __getitem__(self, key):
+        return self.audio[key], self.paramMatrix[key]
+
+    def column(self, name):
+        '''Column of the parameter matrix by name, e.g. "synth_cf", "user_cf", "chunk" or "example"'''
+        return self.paramMatrix[:, self.columns.index(name)]
+
+    def query(self, pname, minval, maxval, units="synth"):
+        '''Row indices whose param pname (in "synth" or "user" units) lies in [minval, maxval]'''
+        values = self.column(units + "_" + pname)
+        return np.nonzero((values >= minval) & (values <= maxval))[0]
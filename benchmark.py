@@ -0,0 +1,267 @@
+# Benchmark harness for the generator.
+# Runs generate() with a small deterministic NumPy stand-in synth over grid sizes, numChunks, sample-rate conversion
+# and record formats, and stores throughput, peak RSS and bytes on disk as JSON. Needs no DSSynth checkout.
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+'''
+    Stand-in synth, written to <soundname>.py in a temporary synthDir and loaded by generate.loadSoundModels,
+    together with stand-ins for the DSSynth parammanager and nsjsonmanager modules (used if DSSynth is not installed)
+'''
+SYNTH_NAME = "BenchSynth"
+SYNTH_SOURCE = """import numpy as np
+
+class BenchSynth():
+    '''Deterministic stand-in synth: decaying sine pops at a given rate and center frequency, placed by self.rng'''
+
+    def __init__(self, sr=16000, rngseed=18005551212):
+        self.sr = sr
+        self.rng = np.random.default_rng(rngseed)
+        self.params = {"rate": 10.0, "cf": 440.0, "decay": 0.02}
+        self.docs = {"rate": "pops per second", "cf": "center frequency of a pop in Hz", "decay": "decay time of a pop in seconds"}
+
+    def setParam(self, name, value):
+        if not name in self.params:
+            raise KeyError("BenchSynth has no parameter " + str(name))
+        self.params[name] = float(value)
+
+    def getParam(self, name, prop="val"):
+        if prop == "synth_doc":
+            return self.docs[name]
+        return self.params[name]
+
+    def generate(self, duration):
+        n = int(round(duration*self.sr))
+        sig = np.zeros(n)
+        onsets = np.sort(self.rng.integers(0, n, self.rng.poisson(self.params["rate"]*duration)))
+        t = np.arange(int(5*self.params["decay"]*self.sr))/self.sr
+        pop = np.sin(2*np.pi*self.params["cf"]*t)*np.exp(-t/self.params["decay"])
+        for onset in onsets:
+            end = min(n, onset + len(pop))
+            sig[onset:end] += pop[:end - onset]
+        return 0.5*sig/max(1.0, np.max(np.abs(sig)))
+"""
+
+PARAMMANAGER_SOURCE = """import json
+import os
+
+class paramManager():
+    '''Stand-in for DSSynth's paramManager: one JSON .params file per wav, rewritten on every addition'''
+
+    def __init__(self, filename, folder):
+        self.filename = filename
+        self.folder = folder
+
+    def initParamFiles(self, overwrite=False):
+        pass
+
+    def addParam(self, pfName, pname, times, values, units=None, nvals=None, minval=None, maxval=None,
+            origUnits=None, origMinval=None, origMaxval=None):
+        self.__update__(pfName, pname, {"times": times, "values": values, "units": units, "nvals": nvals,
+            "minval": minval, "maxval": maxval, "origUnits": origUnits, "origMinval": origMinval, "origMaxval": origMaxval})
+
+    def addMetaParam(self, pfName, pname, value):
+        self.__update__(pfName, "meta", {pname: value})
+
+    def __update__(self, pfName, key, entry):
+        params = {"soundFile": os.path.basename(self.filename)}
+        if os.path.isfile(pfName):
+            with open(pfName) as f:
+                params = json.load(f)
+        if key == "meta":
+            params.setdefault("meta", {}).update(entry)
+        else:
+            params[key] = entry
+        with open(pfName, "w") as f:
+            json.dump(params, f, default=float)
+"""
+
+NSJSON_SOURCE = """class nsJson():
+    '''Stand-in for DSSynth's nsJson: records keyed by name in self.data'''
+
+    def __init__(self, outPath, fname, numFiles, sr, soundname):
+        self.data = {}
+
+    def storeSingleRecord(self, name):
+        self.data[name] = {"note_str": name}
+
+    def addParams(self, name, pname, userval, synthval):
+        self.data[name][pname] = {"user": userval, "synth": synthval}
+"""
+
+'''Files of the synthDir, by path relative to it'''
+SYNTH_FILES = {SYNTH_NAME + ".py": SYNTH_SOURCE, "parammanager/__init__.py": "", "parammanager/paramManager.py": PARAMMANAGER_SOURCE,
+    "nsjsonmanager/__init__.py": "", "nsjsonmanager/nsjson.py": NSJSON_SOURCE}
+
+FORMATS = ["params", "nsjson", "tfrecords", "array", "tarshards"]
+
+'''Modules a record format needs beyond the generator and the synthDir stand-ins; formats missing one are skipped'''
+FORMAT_MODULES = {"params": [], "nsjson": [], "tfrecords": ["tfrecordmanager"], "array": [], "tarshards": []}
+
+RESULT_MARK = "BENCHMARK_RESULT "
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks the generator with a built-in stand-in synth")
+    parser.add_argument("--output", default=None, help="results file (default benchmark-<commit>.json)")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, help="record formats to run")
+    parser.add_argument("--grid-sizes", type=int, nargs="+", default=[2, 4, 8], help="values per swept param (2 params)")
+    parser.add_argument("--num-chunks", type=int, nargs="+", default=[1, 4], help="numChunks settings")
+    parser.add_argument("--duration", type=float, default=4.0, help="soundDuration in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="synthesis processes per run")
+    parser.add_argument("--keep", action="store_true", help="keep the generated datasets")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare throughput against")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def benchConfig(synthDir, outputpath, case):
+    '''Generator config of one benchmark case'''
+    return {
+        "soundname": SYNTH_NAME,
+        "synthDir": synthDir,
+        "outputpath": outputpath,
+        "computeSR": 44100 if case["resample"] else 16000,
+        "datafileSR": 16000,
+        "soundDuration": case["duration"],
+        "numChunks": case["numChunks"],
+        "recordFormat": case["recordFormat"],
+        "tftype": "shards",
+        "rngseed": 1234,
+        "workers": case["workers"],
+        "progressSecs": 3600,
+        "params": [
+            {"user_pname": "rate", "user_minval": 2, "user_maxval": 20, "user_nvals": case["gridSize"],
+                "user_doc": "pops per second", "synth_pname": "rate", "synth_minval": 2, "synth_maxval": 20},
+            {"user_pname": "cf", "user_minval": 220, "user_maxval": 880, "user_nvals": case["gridSize"],
+                "user_doc": "center frequency", "synth_pname": "cf", "synth_minval": 220, "synth_maxval": 880}
+        ],
+        "fixedParams": [
+            {"user_doc": "pop decay", "synth_pname": "decay", "synth_val": 0.02}
+        ]
+    }
+
+def missingModules(recordFormat):
+    return [m for m in FORMAT_MODULES[recordFormat] if importlib.util.find_spec(m) == None]
+
+def runCase(case):
+    '''
+        Runs one case in this (fresh) process, so that peak RSS belongs to the case alone,
+        and prints its result as one marked JSON line
+    '''
+    missing = missingModules(case["recordFormat"])
+    if len(missing) > 0:
+        print(RESULT_MARK + json.dumps(dict(case, skipped="missing " + ", ".join(missing))))
+        return
+
+    import generate
+
+    workdir = tempfile.mkdtemp(prefix="dsgen-bench-")
+    try:
+        synthDir = os.path.join(workdir, "synth")
+        for relPath, source in SYNTH_FILES.items():
+            path = os.path.join(synthDir, relPath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(source)
+        outputpath = os.path.join(workdir, "out")
+        MyConfig = benchConfig(synthDir, outputpath, case)
+
+        start = time.perf_counter()
+        generate.loadSoundModels(MyConfig)
+        standIns = [m.__name__ for m in [generate.paramManager, generate.nsjson]
+            if m != None and os.path.realpath(m.__file__).startswith(os.path.realpath(synthDir))]
+        generate.generate(MyConfig)
+        wallSecs = time.perf_counter() - start
+
+        with open(os.path.join(outputpath, "metrics.json")) as f:
+            report = json.load(f)
+        '''ru_maxrss is in kilobytes on Linux; worker processes are counted by RUSAGE_CHILDREN'''
+        peakRss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)*1024
+        result = dict(case, wallSecs=wallSecs, chunks=report["chunks"], filesPerSec=report["chunks"]/wallSecs,
+            audioSecsPerSec=report["audioSecs"]/wallSecs, peakRssBytes=peakRss,
+            bytesOnDisk=sum(report["bytes"].values()), bytes=report["bytes"], stages=report["stages"], standIns=standIns)
+        if case["keep"]:
+            result["outputpath"] = outputpath
+        print(RESULT_MARK + json.dumps(result))
+    finally:
+        if not case["keep"]:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def runCaseProcess(case):
+    '''Runs a case in a child process and returns its result'''
+    here = os.path.dirname(os.path.realpath(__file__))
+    proc = subprocess.run([sys.executable, os.path.realpath(__file__), "--run-case", json.dumps(case)],
+        cwd=here, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_MARK):
+            return json.loads(line[len(RESULT_MARK):])
+    return dict(case, failed=proc.stderr.strip().splitlines()[-1:] or ["exit code " + str(proc.returncode)])
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.realpath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+def caseKey(case):
+    return (case["recordFormat"], case["gridSize"], case["numChunks"], case["resample"], case["duration"], case["workers"])
+
+def caseLabel(case):
+    return '{:<10} grid {:>3}x{:<3} chunks {:>2}  sr-conv {:<3}'.format(case["recordFormat"], case["gridSize"], case["gridSize"],
+        case["numChunks"], "on" if case["resample"] else "off")
+
+def printResults(results, previous=None):
+    '''Prints one line per case; with previous results, the files/s ratio to the matching earlier case'''
+    before = {}
+    if previous != None:
+        before = {caseKey(r): r for r in previous["results"] if "filesPerSec" in r}
+    for r in results:
+        if "skipped" in r or "failed" in r:
+            print(caseLabel(r), " skipped:" if "skipped" in r else " FAILED:", r.get("skipped", r.get("failed")))
+            continue
+        line = '{}  {:>8.1f} files/s {:>8.1f} audio-s/s  peak RSS {:>7.1f} MB  {:>9.1f} MB on disk'.format(caseLabel(r),
+            r["filesPerSec"], r["audioSecsPerSec"], r["peakRssBytes"]/2**20, r["bytesOnDisk"]/2**20)
+        if caseKey(r) in before:
+            line = line + '  x{:.2f} vs {}'.format(r["filesPerSec"]/before[caseKey(r)]["filesPerSec"], previous["commit"])
+        print(line)
+
+def main():
+    args = get_arguments()
+    if args.run_case != None:
+        runCase(json.loads(args.run_case))
+        return
+
+    results = []
+    for recordFormat, gridSize, numChunks, resampled in itertools.product(args.formats, args.grid_sizes, args.num_chunks, [False, True]):
+        case = {"recordFormat": recordFormat, "gridSize": gridSize, "numChunks": numChunks, "resample": resampled,
+            "duration": args.duration, "workers": args.workers, "keep": args.keep}
+        print("Running", caseLabel(case), flush=True)
+        results.append(runCaseProcess(case))
+
+    commit = gitCommit()
+    import numpy as np
+    summary = {"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+        "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count(), "results": results}
+    output = args.output if args.output != None else "benchmark-" + commit + ".json"
+    with open(output, "w") as f:
+        json.dump(summary, f, indent=1)
+
+    previous = None
+    if args.compare != None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    printResults(results, previous)
+    print("Results written to", output)
+
+if __name__ == '__main__':
+    main()
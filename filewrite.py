@@ -1,30 +1,56 @@
-
-
 # loosely inspired from the parammanager
 # Takes a file name and path and returns a full path to file.
+import hashlib
+import itertools
 import os
 
+import numpy as np
+
+'''Directory layouts: all files in outpath, hashed fan-out subdirectories, or subdirectories per param value'''
+LAYOUTS = ["flat", "hashed", "param"]
+
+'''Hashed levels are created up front: 256 directories for one level, 65536 for two'''
+MAX_HASHED_LEVELS = 2
+
+def escapeFormat(s):
+    return s.replace('{', '{{').replace('}', '}}')
+
 class fileHandler():
 
     def __init__(self) :
 
         self.fname=""
         self.outpath = ""
+        self.template = None
+        self.templateKey = None
+        self.layout = "flat"
+        self.levels = 1
+        self.paramArr = []
+        self.knownDirs = set()
+
+    def compile(self, soundName, paramArr):
+        '''Compiles the file name template for a sound and its swept params once, instead of concatenating per file'''
+        key = (soundName, tuple(p['user_pname'] for p in paramArr))
+        if key != self.templateKey:
+            self.template = escapeFormat(soundName) + ''.join('--' + escapeFormat(p['user_pname']) + '-{:05.2f}' for p in paramArr)
+            self.templateKey = key
+        return self.template
 
     '''make file name from soundname, paramNames, param values, chunk number, example number'''
-    def makeName(self, soundName, paramArr, enumP, chunk, examples=1, x=1):
+    def makeName(self, soundName, paramArr, enumP, chunk, examples=1, x=1, sample=None):
         '''Construct filenames with static parameters'''
-        self.fname = soundName
         # for paramNum in range(len(fixedParams)):
         #     self.fname = self.fname + '--' + fixedParams[paramNum]['synth_pname'] + '-'+'{:05.2f}'.format(fixedParams[paramNum]["synth_val"])
-        for paramNum in range(len(paramArr)):
-            self.fname = self.fname + '--' + paramArr[paramNum]['user_pname'] + '-'+'{:05.2f}'.format(enumP[paramNum])
+        fname = self.compile(soundName, paramArr).format(*enumP)
+        if sample != None:
+            fname = fname + '--s-'+'{:06}'.format(sample)
         if chunk != None:
-            self.fname = self.fname + '--c-'+'{:02}'.format(chunk)
+            fname = fname + '--c-'+'{:02}'.format(chunk)
         if examples > 1:
-            self.fname = self.fname + '--x-'+'{:02}'.format(x)
+            fname = fname + '--x-'+'{:02}'.format(x)
 
-        return self.fname
+        self.fname = fname
+        return fname
 
     def getFileName(self):
         return self.fname
@@ -32,11 +58,59 @@ class fileHandler():
     def getFullPath(self):
         return self.outpath
 
+    def setLayout(self, outpath, paramArr, layout="flat", levels=1, sampled=False):
+        '''
+            Sets the directory layout under outpath and creates all its directories up front:
+            "flat" puts every file in outpath, "hashed" in levels of 256 subdirectories named by the hash of the
+            file name, and "param" in nested subdirectories per value of the first levels swept params.
+            Sampled (non-grid) param values are not known in advance, so their "param" directories are created
+            by layoutPath as files arrive.
+        '''
+        if not layout in LAYOUTS:
+            raise ValueError("unknown layout " + str(layout) + ", expected one of " + str(LAYOUTS))
+        if layout == "hashed" and (levels < 1 or levels > MAX_HASHED_LEVELS):
+            raise ValueError("hashed layouts have 1 to " + str(MAX_HASHED_LEVELS) + " levels, got " + str(levels))
+        self.layout = layout
+        self.levels = levels
+        self.paramArr = paramArr[:levels]
+
+        dirs = [outpath]
+        if layout == "hashed":
+            for digits in itertools.product(['{:02x}'.format(i) for i in range(256)], repeat=levels):
+                dirs.append(os.path.join(outpath, *digits))
+        elif layout == "param" and not sampled:
+            values = [np.linspace(p["user_minval"], p["user_maxval"], p["user_nvals"], endpoint=True) for p in self.paramArr]
+            for enumP in itertools.product(*values):
+                dirs.append(self.layoutDir(outpath, None, enumP))
+        for d in dirs:
+            os.makedirs(d, exist_ok=True)
+        self.knownDirs.update(dirs)
+
+    def layoutDir(self, outpath, name, enumP):
+        '''Directory of a file under the current layout, from its name (hashed) or its user param values (param)'''
+        if self.layout == "hashed":
+            digest = hashlib.sha1(name.encode()).hexdigest()
+            return os.path.join(outpath, *[digest[2*i:2*i+2] for i in range(self.levels)])
+        if self.layout == "param":
+            return os.path.join(outpath, *[p['user_pname'] + '-' + '{:05.2f}'.format(v) for p, v in zip(self.paramArr, enumP)])
+        return outpath
+
+    def layoutPath(self, outpath, name, ext, enumP):
+        '''Full path of a file under the current layout; directories not created by setLayout are made here once'''
+        self.outpath = self.layoutDir(outpath, name, enumP)
+        if not self.outpath in self.knownDirs:
+            os.makedirs(self.outpath, exist_ok=True)
+            self.knownDirs.add(self.outpath)
+        return os.path.join(self.outpath, name + ext)
+
     # only store the actual value, not the normed value used for setting
     def makeFullPath(self, outpath, name, ext) :
 
-        if os.path.isdir(outpath):
+        if outpath in self.knownDirs:
+            self.outpath = outpath
+        elif os.path.isdir(outpath):
             self.outpath = outpath
+            self.knownDirs.add(outpath)
         else:
             self.outpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), outpath)
             if not os.path.isdir(self.outpath):
@@ -1,27 +1,54 @@
 # dependencies for file reading
 import json
 import sys
-import itertools
 import numpy as np
 import os
 import soundfile as sf
 import math
-
-import librosa # conda install -c conda-forge librosa
+import itertools
+import collections
 
 # make script paths from one level up avaialble for import
 script_path = os.path.realpath(os.path.dirname(__name__))
 os.chdir(script_path)
 sys.path.append(script_path)
 
-from parammanager import paramManager
-from nsjsonmanager import nsjson
-
-
-from genericsynth import synthInterface as SI
+'''The DSSynth utility modules are only needed by the formats that use them (params, nsjson, tarshards)'''
+paramManager = None
+nsjson = None
+
+def loadDSSynthModules():
+    '''Imports the DSSynth parammanager and nsjsonmanager modules, if they are on sys.path'''
+    global paramManager, nsjson
+    try:
+        from parammanager import paramManager
+        from nsjsonmanager import nsjson
+    except ImportError:
+        paramManager = None
+        nsjson = None
+
+loadDSSynthModules()
+from nsjsonstream import nsjsonStream, finalizeNsjson, makeRecord
+from tfshardwriter import tfShardWriter, configShardBytes, configShardRecords, tfrecordPath
+from outputpipeline import outputPipeline
+from resampler import resample
+from signalcache import signalCache, signalKey, CACHE_BYTES
+from arrayrecord import arrayWriter
+from tarshards import tarShardWriter, TARSHARD_BYTES
+from metrics import runMetrics
+
+
+try:
+    from genericsynth import synthInterface as SI
+except ImportError:
+    SI = None
 from filewrite import fileHandler
+from paramgrid import makeParamGrid
+from manifest import runManifest, shardRange, shardSuffix, configHash, completedChunks, previousSeed
 
 import importlib
+import io
+import hashlib
 
 
 '''
@@ -57,24 +84,41 @@ Example: If each parameter is sampled at 5 values, the long signal is 10 seconds
 then The the total amount of audio generated is 5*5*5*10= 1250 seconds of sound (about 25 hours; ~3Gb at 16K sr).
 If each chunk is 2 seconds, then there will be 10/2=5 chunks for each parameter setting, and
 5*5*5*5 = 625 files
+Run with --plan to have these numbers (and size and runtime estimates) worked out for a config.
 '''
 
 import argparse
+import multiprocessing
+import cProfile
+import pstats
 
 myConfig = {}
 soundModels = {}
 outputpath = ""
 
+'''Per-process state of a generation worker (synth instance, grid, base seed)'''
+workerState = {}
+
 def get_arguments():
     parser = argparse.ArgumentParser(description="myParser")
     parser.add_argument("--configfile", required=True)
     parser.add_argument("--outputpath", required=True)
+    parser.add_argument("--workers", type=int, default=None, help="number of synthesis processes (overrides config 'workers')")
+    parser.add_argument("--shard-index", type=int, default=0, help="index of the shard of the dataset generated by this run")
+    parser.add_argument("--num-shards", type=int, default=1, help="number of shards the dataset is split into")
+    parser.add_argument("--resume", action="store_true", help="skip chunks completed by earlier runs in outputpath")
+    parser.add_argument("--signal-cache", default=None, help="directory of the long-signal cache (overrides config 'signalCache')")
+    parser.add_argument("--writer-threads", type=int, default=None, help="number of output writer threads, 0 writes inline (overrides config 'writerThreads')")
+    parser.add_argument("--profile", action="store_true", help="run under cProfile and dump the stats to profile.prof in outputpath")
+    parser.add_argument("--plan", action="store_true", help="print file counts, size and runtime estimates and validate the config, without generating")
+    parser.add_argument("--plan-jobs", type=int, default=5, help="number of jobs synthesized to estimate the runtime with --plan")
     return parser.parse_args()
 
 ''' Returns a chunked wav files from generated signal '''
 def selectChunk(sig, sr, chunkNum, chunkSecs):
+        '''Chunk of a signal, or of every signal of a 2-D batch (time is the last axis)'''
         chunkSamples=math.floor(sr*chunkSecs)
-        return sig[chunkNum*chunkSamples:(chunkNum+1)*chunkSamples]
+        return sig[..., chunkNum*chunkSamples:(chunkNum+1)*chunkSamples]
 
 
 def main():
@@ -98,22 +142,67 @@ def main():
         # for p in MyConfig['fixedParams']:
         #     p['formula'] = eval("lambda *args: " + p['formula'])        
 
-    loadSoundModels(MyConfig)
+    '''With --plan, a synth that fails to load is reported by the planner'''
+    if not args.plan:
+        loadSoundModels(MyConfig)
     MyConfig["outputpath"] = outputpath
+    if args.workers != None:
+        MyConfig["workers"] = args.workers
+    MyConfig["shardIndex"] = args.shard_index
+    MyConfig["numShards"] = args.num_shards
+    MyConfig["resume"] = args.resume
+    if args.writer_threads != None:
+        MyConfig["writerThreads"] = args.writer_threads
+    if args.signal_cache != None:
+        MyConfig["signalCache"] = args.signal_cache
 
     # from args.configfile import MyConfig # <-- how is that possible?
-    generate(MyConfig)
+    if args.plan:
+        '''Dry run: nothing is written, and the exit status tells whether problems were found'''
+        from planner import planRun
+        plan, problems = planRun(MyConfig, args.plan_jobs)
+        sys.exit(1 if len(problems) > 0 else 0)
+
+    if args.profile:
+        '''Profiles this process only; worker process time shows up in the metrics report instead'''
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            generate(MyConfig)
+        finally:
+            profiler.disable()
+            if os.path.isdir(outputpath):
+                profilePath = os.path.join(outputpath, "profile" + shardSuffix(args.shard_index, args.num_shards) + ".prof")
+                profiler.dump_stats(profilePath)
+                print("Profile written to", profilePath)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    else:
+        generate(MyConfig)
 
     # print(MyConfig["params"])
 
 def loadSoundModels(MyConfig):
+    '''
+        Loads the synth module <soundname>.py from "synthDir" (default: the current directory).
+        DSSynth utility modules not found at startup are also looked up in "synthDir".
+    '''
     dirpath = os.getcwd()
+    if "synthDir" in MyConfig and MyConfig["synthDir"] != None:
+        dirpath = MyConfig["synthDir"]
+        if not dirpath in sys.path:
+            sys.path.insert(0, dirpath)
+        if paramManager == None or nsjson == None:
+            importlib.invalidate_caches()
+            loadDSSynthModules()
     # modules = [f for f in os.listdir(os.path.dirname(dirpath)) if f[0] != "." and f[0] != "_"]
     # for module in modules:
     spec = importlib.util.spec_from_file_location(dirpath, os.path.join(dirpath,MyConfig["soundname"]+".py"))
     mod = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(mod)
     soundModels["sound"] = mod
+    '''Source hash of the synth module, part of the signal cache key'''
+    with open(os.path.join(dirpath,MyConfig["soundname"]+".py"), "rb") as f:
+        soundModels["hash"] = hashlib.sha1(f.read()).hexdigest()
     # mod_name = file[:-3]   # strip .py at the end
     # exec('from soundModels' + ' import ' + os.path.abspath(mod_name))
 
@@ -124,6 +213,308 @@ def loadSoundModels(MyConfig):
     #    spec.loader.exec_module(mod)
     # importlib.import_module(dirpath + directory)
 
+def chunkName(fileHandle, MyConfig, grid, index, chnk, examples, x):
+    '''
+        File name (without extension) of one chunk of grid entry index; single-chunk files carry no chunk number,
+        and sampled entries also carry their sample index
+    '''
+    chunkId = None if MyConfig["numChunks"] == 1 else chnk
+    sample = index if grid.sampled else None
+    return fileHandle.makeName(MyConfig["soundname"], MyConfig["params"], grid[index][0], chunkId, examples, x, sample)
+
+'''Run seed of configs without an "rngseed" key (the default rngseed of the DSSynth synths), so that they stay reproducible'''
+DEFAULT_SEED = 18005551212
+
+def randomSeed(MyConfig):
+    '''True if the config asks for a freshly drawn seed ("rngseed": null)'''
+    return "rngseed" in MyConfig and MyConfig["rngseed"] == None
+
+def baseSeed(MyConfig):
+    '''Returns the run seed: the config rngseed, DEFAULT_SEED if it is missing, or a freshly drawn one if it is null'''
+    if not "rngseed" in MyConfig:
+        print("Using default random seed", DEFAULT_SEED)
+        return DEFAULT_SEED
+    if MyConfig["rngseed"] != None:
+        print("Using user random seed", MyConfig["rngseed"])
+        return MyConfig["rngseed"]
+    ''' Generate random seed '''
+    seed = int(np.random.randint(0, np.power(2,32), dtype=np.int64))
+    print("Using user random seed", seed)
+    return seed
+
+def settingKey(grid, index):
+    '''
+        Identity of a param setting that does not depend on the grid shape: its user values at file-name precision,
+        and for sampled settings also the sample index (both are part of the file name)
+    '''
+    key = ",".join('{:.2f}'.format(v) for v in grid[index][0])
+    if grid.sampled:
+        key = key + ",s" + str(index)
+    return key
+
+def jobSeed(seed, grid, jobIndex):
+    '''
+        Derives the seed of one (example, combination) job from the run seed, the example number and the param setting,
+        not from the flat job index, so that a job keeps its seed (and its output) when the grid or examples are extended
+    '''
+    x, index = divmod(jobIndex, len(grid))
+    '''The setting hash is never 0, so job keys (x, setting) are disjoint from the (index, 0) keys of uniform sampling'''
+    setting = int(hashlib.sha1(settingKey(grid, index).encode()).hexdigest()[:15], 16) + 1
+    return int(np.random.SeedSequence(seed, spawn_key=(x, setting)).generate_state(1)[0])
+
+def makeSynth(MyConfig, seed):
+    '''Instantiates the configured synth class and sets its fixed parameters (in natural units)'''
+    barsynthclass = getattr(soundModels["sound"],MyConfig["soundname"])
+    barsynth= barsynthclass(sr=MyConfig["computeSR"], rngseed=seed)
+    for fixparams in MyConfig["fixedParams"]:
+        fixparams["synth_units"] = "natural"
+        barsynth.setParam(fixparams["synth_pname"], fixparams["synth_val"])
+    return barsynth
+
+def seedSynth(barsynth, MyConfig, seed):
+    '''
+        Re-seeds a synth for a new job. Synths keeping their generator in self.rng are re-seeded in place,
+        any other synth is re-instantiated with the job seed.
+    '''
+    np.random.seed(seed % np.power(2,32))
+    rng = getattr(barsynth, "rng", None)
+    if isinstance(rng, np.random.Generator):
+        barsynth.rng = np.random.default_rng(seed)
+    elif isinstance(rng, np.random.RandomState):
+        barsynth.rng = np.random.RandomState(seed % np.power(2,32))
+    else:
+        barsynth = makeSynth(MyConfig, seed)
+    return barsynth
+
+def initWorker(MyConfig, seed, grid):
+    '''Sets up a generation worker: loads the synth module and builds this process's synth instance once'''
+    loadSoundModels(MyConfig)
+    workerState.update(makeJobState(MyConfig, seed, grid))
+
+def makeJobState(MyConfig, seed, grid):
+    '''
+        State needed to render jobs: config, run seed, grid, a synth instance (the synth module must be loaded),
+        the long-signal cache, if "signalCache" names a cache directory, and the stage timings of this process.
+    '''
+    cache = None
+    if "signalCache" in MyConfig and MyConfig["signalCache"] != None:
+        cacheBytes = CACHE_BYTES
+        if "signalCacheBytes" in MyConfig:
+            cacheBytes = MyConfig["signalCacheBytes"]
+        cache = signalCache(MyConfig["signalCache"], cacheBytes)
+    return {"config": MyConfig, "seed": seed, "grid": grid, "synth": makeSynth(MyConfig, seed), "cache": cache,
+        "metrics": runMetrics()}
+
+def synthesizeJob(jobIndex):
+    '''Renders one job with this worker's state (see renderBatch)'''
+    return renderBatch(workerState, [jobIndex])[0]
+
+def synthesizeBatch(jobIndices):
+    '''Renders a block of jobs with this worker's state (see renderBatch), and hands over the stage timings taken meanwhile'''
+    results = renderBatch(workerState, jobIndices)
+    return results, workerState["metrics"].drain()
+
+def imapBounded(pool, fn, tasks, maxPending):
+    '''
+        Like pool.imap(fn, tasks), in task order, but with at most maxPending tasks submitted ahead of the consumer,
+        so that synthesis cannot run arbitrarily far ahead of writing
+    '''
+    tasks = iter(tasks)
+    pending = collections.deque(pool.apply_async(fn, (task,)) for task in itertools.islice(tasks, max(1, maxPending)))
+    while len(pending) > 0:
+        result = pending.popleft().get()
+        for task in itertools.islice(tasks, 1):
+            pending.append(pool.apply_async(fn, (task,)))
+        yield result
+
+def batchJobs(jobIndices, batchSize):
+    '''Groups a stream of job indices into lists of up to batchSize consecutive entries'''
+    jobIndices = iter(jobIndices)
+    while True:
+        batch = list(itertools.islice(jobIndices, batchSize))
+        if len(batch) == 0:
+            return
+        yield batch
+
+def isBatchSynth(barsynth):
+    '''
+        Synths may render many parameter settings at once by defining
+            generateBatch(paramMatrix, duration, seeds)
+        paramMatrix has one row per setting and one column per swept param (natural units, in "params" order),
+        seeds holds the job seed of each row, and the result is a 2-D array with one long signal per row.
+        Fixed params are set on the instance beforehand, as for generate(). Each row must depend only on its
+        params and seed, so that the output does not depend on how jobs are grouped into batches.
+    '''
+    return callable(getattr(barsynth, "generateBatch", None))
+
+def setJobParams(barsynth, paramArr, synthP):
+    '''Sets the swept params of one job (natural ranges) and returns the values the synth reports for them'''
+    for paramInd in range(len(paramArr)):
+        '''Setting in natural ranges'''
+        barsynth.setParam(paramArr[paramInd]["synth_pname"], synthP[paramInd])
+    return [barsynth.getParam(p["synth_pname"]) for p in paramArr]
+
+def jobSignalKey(MyConfig, synthP, seed):
+    '''Signal-cache key of one job: synth source, full synth parameter vector, job seed, rate and duration'''
+    synthParams = [(p["synth_pname"], synthP[pnum]) for pnum, p in enumerate(MyConfig["params"])]
+    synthParams += [(p["synth_pname"], p["synth_val"]) for p in MyConfig["fixedParams"]]
+    return signalKey(soundModels["hash"], synthParams, seed, MyConfig["computeSR"], MyConfig["soundDuration"])
+
+def chunkSignal(MyConfig, barsig, metrics):
+    '''
+        Resamples a long signal (or a 2-D batch of them) once, so there are no per-chunk filter edges,
+        then slices it into numChunks chunks at the target rate
+    '''
+    backend = "scipy"
+    if "resampler" in MyConfig:
+        backend = MyConfig["resampler"]
+    with metrics.stage("resample"):
+        barsig = resample(barsig, MyConfig["computeSR"], MyConfig["datafileSR"], backend)
+
+    numChunks=MyConfig["numChunks"]
+    chunkSecs = MyConfig["soundDuration"]/numChunks
+    chunks = []
+    for chnk in range(numChunks):
+        chunks.append(selectChunk(barsig, MyConfig["datafileSR"], chnk, chunkSecs))
+    return chunks
+
+def renderJob(state, jobIndex):
+    '''
+        Synthesizes the long signal of one (example, combination) job with its own seed and returns it
+        chunked (and resampled) together with the values the synth reports for the swept params.
+    '''
+    MyConfig = state["config"]
+    grid = state["grid"]
+    x, index = divmod(jobIndex, len(grid))
+    userP, synthP = grid[index]
+
+    seed = jobSeed(state["seed"], grid, jobIndex)
+    barsynth = seedSynth(state["synth"], MyConfig, seed)
+    state["synth"] = barsynth
+    synthVals = setJobParams(barsynth, MyConfig["params"], synthP)
+
+    '''
+        With a signal cache, long signals are looked up by content and stored as float32; the cached copy is used
+        on a miss too, so the output does not depend on whether the cache was hit.
+    '''
+    cache = state["cache"]
+    metrics = state["metrics"]
+    barsig = None
+    if cache != None:
+        key = jobSignalKey(MyConfig, synthP, seed)
+        with metrics.stage("cache"):
+            barsig = cache.get(key)
+    if barsig is None:
+        with metrics.stage("synth"):
+            barsig=barsynth.generate(MyConfig["soundDuration"])
+        if cache != None:
+            with metrics.stage("cache"):
+                barsig = cache.put(key, barsig)
+
+    return jobIndex, synthVals, chunkSignal(MyConfig, barsig, metrics)
+
+def renderBatch(state, jobIndices):
+    '''
+        Renders a block of jobs, returning a list of renderJob results. Synths with generateBatch (see isBatchSynth)
+        synthesize all settings of the block (cache misses only) in one call, and the block is resampled and chunked
+        as one 2-D array; other synths fall back to one renderJob per job.
+    '''
+    MyConfig = state["config"]
+    grid = state["grid"]
+    barsynth = state["synth"]
+    if not isBatchSynth(barsynth):
+        return [renderJob(state, jobIndex) for jobIndex in jobIndices]
+
+    seeds = [jobSeed(state["seed"], grid, jobIndex) for jobIndex in jobIndices]
+    synthPs = [grid[jobIndex % len(grid)][1] for jobIndex in jobIndices]
+    synthVals = [setJobParams(barsynth, MyConfig["params"], synthP) for synthP in synthPs]
+
+    cache = state["cache"]
+    metrics = state["metrics"]
+    signals = [None]*len(jobIndices)
+    keys = [None]*len(jobIndices)
+    if cache != None:
+        with metrics.stage("cache"):
+            for row in range(len(jobIndices)):
+                keys[row] = jobSignalKey(MyConfig, synthPs[row], seeds[row])
+                signals[row] = cache.get(keys[row])
+    missing = [row for row in range(len(jobIndices)) if signals[row] is None]
+
+    if len(missing) > 0:
+        paramMatrix = np.array([synthVals[row] for row in missing], dtype=np.float64).reshape(len(missing), len(MyConfig["params"]))
+        with metrics.stage("synth"):
+            block = barsynth.generateBatch(paramMatrix, MyConfig["soundDuration"], [seeds[row] for row in missing])
+        if len(missing) == len(jobIndices) and cache == None:
+            signals = block
+        else:
+            with metrics.stage("cache"):
+                for row, sig in zip(missing, block):
+                    signals[row] = sig if cache == None else cache.put(keys[row], sig)
+    chunks = chunkSignal(MyConfig, np.asarray(signals), metrics)
+
+    return [(jobIndex, synthVals[row], [chunk[row] for chunk in chunks]) for row, jobIndex in enumerate(jobIndices)]
+
+def writeParamFile(MyConfig, barsynth, wavPath, paramFolder, pfName, userP, chunkSecs):
+    '''Writes the .params file of one chunk: the swept params with their docs, and the fixed params as meta params'''
+    paramArr = MyConfig["params"]
+    fixedParams = MyConfig["fixedParams"]
+    pm=paramManager.paramManager(wavPath, paramFolder)
+    pm.initParamFiles(overwrite=True)
+
+    '''Write parameters and meta-parameters'''
+    for pnum in range(len(paramArr)):
+            #pm.addParam(pfName, paramArr[pnum]['synth_pname'], [0,MyConfig["soundDuration"]], [userP[pnum], userP[pnum]], units=paramArr[pnum]['synth_units'], nvals=paramArr[pnum]['user_nvals'], minval=paramArr[pnum]['user_minval'], maxval=paramArr[pnum]['user_maxval'], origUnits=None, origMinval=paramArr[pnum]['synth_minval'], origMaxval=paramArr[pnum]['synth_maxval'])
+            pm.addParam(pfName, paramArr[pnum]['synth_pname'], [0,chunkSecs], [userP[pnum], userP[pnum]], units=paramArr[pnum]['synth_units'], nvals=paramArr[pnum]['user_nvals'], minval=paramArr[pnum]['user_minval'], maxval=paramArr[pnum]['user_maxval'], origUnits=None, origMinval=paramArr[pnum]['synth_minval'], origMaxval=paramArr[pnum]['synth_maxval'])
+            
+            if "user_doc" in paramArr[pnum] and paramArr[pnum]["user_doc"] != "" :
+                pm.addMetaParam(pfName, paramArr[pnum]['synth_pname']+"_user_doc",paramArr[pnum]['user_doc']) 
+
+            pm.addMetaParam(pfName, paramArr[pnum]['synth_pname']+"_synth_doc",barsynth.getParam(paramArr[pnum]["synth_pname"],"synth_doc"))
+    
+    for pnum in range(len(fixedParams)):
+        ######pm.addParam(pfName, fixedParams[pnum]['synth_pname'], [0,MyConfig["soundDuration"]], [fixedParams[pnum]["synth_val"], fixedParams[pnum]["synth_val"]], units=fixedParams[pnum]['synth_units'], nvals=2, origUnits=None)
+        #pm.addMetaParam(pfName, fixedParams[pnum]['synth_pname']+" (FIXED_VAL)",barsynth.getParam(fixedParams[pnum]["synth_pname"]))
+        #if "user_doc" in fixedParams[pnum] and fixedParams[pnum]["user_doc"] != "" :
+        #    pm.addMetaParam(pfName, fixedParams[pnum]['synth_pname']+"_user_doc",fixedParams[pnum]['user_doc']) 
+        #pm.addMetaParam(pfName, fixedParams[pnum]['synth_pname']+"_synth_doc",barsynth.getParam(fixedParams[pnum]["synth_pname"],"synth_doc"))
+
+        docstr= f" {barsynth.getParam(fixedParams[pnum]['synth_pname'])}, "
+        if "user_doc" in fixedParams[pnum] and fixedParams[pnum]["user_doc"] != "" :
+            docstr=docstr+fixedParams[pnum]['user_doc']+ ", "
+        docstr=docstr+barsynth.getParam(fixedParams[pnum]["synth_pname"],"synth_doc")
+        pm.addMetaParam(pfName, "(FIXED_VAL) " + fixedParams[pnum]['synth_pname'], docstr)
+
+def chunkRecord(MyConfig, barsynth, sg, name, userP, synthVals, chunkSecs):
+    '''
+        JSON param record of one chunk for self-describing formats: its nsjson record, plus what its .params file
+        holds (ranges and docs of the swept params, values and docs of the fixed params)
+    '''
+    paramArr = MyConfig["params"]
+    fixedParams = MyConfig["fixedParams"]
+    record = {"name": name, "soundDuration": [0, chunkSecs], "params": {}, "fixedParams": {},
+        "nsjson": makeRecord(sg, name, [p["synth_pname"] for p in paramArr], userP, synthVals)}
+    for pnum in range(len(paramArr)):
+        p = paramArr[pnum]
+        record["params"][p["synth_pname"]] = {"user": userP[pnum], "synth": synthVals[pnum], "units": p["synth_units"],
+            "nvals": p["user_nvals"], "minval": p["user_minval"], "maxval": p["user_maxval"],
+            "origMinval": p["synth_minval"], "origMaxval": p["synth_maxval"],
+            "user_doc": p["user_doc"] if "user_doc" in p else "", "synth_doc": barsynth.getParam(p["synth_pname"], "synth_doc")}
+    for p in fixedParams:
+        record["fixedParams"][p["synth_pname"]] = {"value": barsynth.getParam(p["synth_pname"]),
+            "user_doc": p["user_doc"] if "user_doc" in p else "", "synth_doc": barsynth.getParam(p["synth_pname"], "synth_doc")}
+    return record
+
+def writeChunkFiles(MyConfig, barsynth, newsig, wavPath, paramFolder, pfName, userP, chunkSecs, metrics):
+    '''Output task of one chunk: encodes the wav and, for the params format, writes its param file. Returns the paths written.'''
+    with metrics.stage("wav"):
+        sf.write(wavPath, newsig, MyConfig["datafileSR"], subtype='PCM_16')
+    outputs = [wavPath]
+    if MyConfig["recordFormat"] == "params" or MyConfig["recordFormat"]==0:
+        with metrics.stage("params"):
+            writeParamFile(MyConfig, barsynth, wavPath, paramFolder, pfName, userP, chunkSecs)
+        outputs.append(pfName)
+    return outputs
+
 def generate(MyConfig):
     
     '''Initializes file through a filemanager'''
@@ -132,6 +523,12 @@ def generate(MyConfig):
     dirpath = "/"
     outputpath = MyConfig["outputpath"]
 
+    '''Stage timings and throughput of this run; progress is printed every "progressSecs" seconds (default 5)'''
+    progressSecs = 5
+    if "progressSecs" in MyConfig:
+        progressSecs = MyConfig["progressSecs"]
+    metrics = runMetrics(progressSecs)
+
     if os.path.isdir(outputpath):
         print("Outpath exists")
     else:
@@ -147,51 +544,84 @@ def generate(MyConfig):
             Create chunk parameter files
     '''
 
-    '''2 arrays for normalised and naturalised ranges'''
-    userRange = []
-    synthRange = []
     paramArr = MyConfig["params"]
     fixedParams = MyConfig["fixedParams"]
 
-    for p in MyConfig["params"]:
-            userRange.append(np.linspace(p["user_minval"], p["user_maxval"], p["user_nvals"], endpoint=True))
-            synthRange.append(np.linspace(p["synth_minval"], p["synth_maxval"], p["user_nvals"], endpoint=True))
-        
-    userParam = list(itertools.product(*userRange))
-    synthParam = list(itertools.product(*synthRange))
+    '''One file handler for the whole run: name template compiled once, layout directories created up front'''
+    layout = "flat"
+    if "layout" in MyConfig:
+        layout = MyConfig["layout"]
+    layoutLevels = 1
+    if "layoutLevels" in MyConfig:
+        layoutLevels = MyConfig["layoutLevels"]
+    fileHandle.compile(MyConfig["soundname"], paramArr)
 
     numChunks=MyConfig["numChunks"]
     #math.floor(MyConfig["soundDuration"]/MyConfig["chunkSecs"])  #Total duraton DIV duraiton of each chunk 
-
-    totalDuration = len(userParam)*MyConfig["soundDuration"] # Total duration of the audio textures generated for this dataset'''
+    chunkSecs = MyConfig["soundDuration"]/numChunks
  
-    '''Set fixed parameters prior to the generation'''
-    # print(soundModels[MyConfig["soundname"]].PatternSynth)
-    barsynthclass = getattr(soundModels["sound"],MyConfig["soundname"])
-
-    '''use a sample rate and rng seed if initialized'''
-    if not "rngseed" in MyConfig:
-        barsynth= barsynthclass(sr=MyConfig["computeSR"])
-    elif MyConfig["rngseed"] == None:
-        ''' Generate random seed '''
-        seed = np.random.randint(0, np.power(2,32))
-        print("Using user random seed", seed)
-        barsynth= barsynthclass(sr=MyConfig["computeSR"], rngseed=seed)
-    else:
-        print("Using user random seed", MyConfig["rngseed"])
-        barsynth= barsynthclass(sr=MyConfig["computeSR"], rngseed=MyConfig["rngseed"])
+    '''
+        Every job is seeded from the run seed, its example number and its param setting (see jobSeed), so the output
+        depends neither on the worker count nor on the grid shape.
+        This process keeps its own synth instance for the param docs written into the records.
+    '''
+    shardIndex = 0
+    numShards = 1
+    if "numShards" in MyConfig:
+        shardIndex = MyConfig["shardIndex"]
+        numShards = MyConfig["numShards"]
+    if numShards > 1 and randomSeed(MyConfig):
+        print("Sharded runs need a fixed (or default) rngseed in the config, so that every shard synthesizes the same dataset")
+        sys.exit(1)
+
+    '''A resumed run with a drawn seed continues with the seed of the run it resumes'''
+    resume = "resume" in MyConfig and MyConfig["resume"]
+    if resume and randomSeed(MyConfig) and previousSeed(outputpath) != None:
+        MyConfig["rngseed"] = previousSeed(outputpath)
+
+    seed = baseSeed(MyConfig)
+    barsynth = makeSynth(MyConfig, seed)
     print(barsynth)
 
+    '''
+        Lazy grid decoding normalised and naturalised values from a flat combination index,
+        or "samples" settings drawn from the param ranges by the "sampling" mode (seeded by the run seed)
+    '''
+    try:
+        grid = makeParamGrid(MyConfig, seed)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print("Generating", len(grid), "param settings, sampling:", grid.mode)
+    totalDuration = len(grid)*MyConfig["soundDuration"] # Total duration of the audio textures generated for this dataset'''
+    if MyConfig["recordFormat"] != "array" and MyConfig["recordFormat"] != "tarshards":
+        try:
+            fileHandle.setLayout(outputpath, paramArr, layout, layoutLevels, grid.sampled)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
     # Manually set the parameters to Natural    
     for params in paramArr:
         params["synth_units"] = "natural"
-
-    for fixparams in fixedParams:
-        '''Setting in natural ranges'''
-        fixparams["synth_units"] = "natural"
-        barsynth.setParam(fixparams["synth_pname"], fixparams["synth_val"])
     
-    sg = nsjson.nsJson("/", outputpath, 1, MyConfig["datafileSR"], MyConfig['soundname'])
+    '''params files need the DSSynth parammanager, nsjson and tar shard records the nsjsonmanager'''
+    if (MyConfig["recordFormat"] == "params" or MyConfig["recordFormat"] == 0) and paramManager == None:
+        print("The params format needs the DSSynth parammanager module; install DSSynth and run again")
+        sys.exit(1)
+    if (MyConfig["recordFormat"] == "nsjson" or MyConfig["recordFormat"] == 1 or MyConfig["recordFormat"] == "tarshards") and nsjson == None:
+        print("The", MyConfig["recordFormat"], "format needs the DSSynth nsjsonmanager module; install DSSynth and run again")
+        sys.exit(1)
+    sg = None
+    if nsjson != None:
+        sg = nsjson.nsJson("/", outputpath, 1, MyConfig["datafileSR"], MyConfig['soundname'])
+    nsjsonName = "nsjson" + shardSuffix(shardIndex, numShards) + ".json"
+    nsjsonStreamName = "nsjson" + shardSuffix(shardIndex, numShards) + ".jsonl"
+
+    '''nsjson records are streamed as JSON Lines; "stream" (default) also writes the classic document at the end, "jsonl" does not'''
+    nsjsonMode = "stream"
+    if "nsjsonMode" in MyConfig:
+        nsjsonMode = MyConfig["nsjsonMode"]
 
     '''Only initialize if record is in tfrecord format'''
     if MyConfig["recordFormat"] == "tfrecords":
@@ -200,165 +630,233 @@ def generate(MyConfig):
             tfr=tfrecordManager.tfrecordManager()
         except:
             print("Please install tfrecords with <pip install -r requirements_tf.txt --src '.'> and run again")
-            sys.exit()
+            sys.exit(1)
 
-    '''files for agrregate tfrecord writing'''
-    audioSegments = []
-    pfnames = []
-    soundDurations = []
-    segmentNum = []
-    usertfP = []
-    synthtfP = []
+    '''Size in bytes of aggregate tfrecord shards; legacy "shard_size" configs are cut by record count instead'''
+    shardBytes = configShardBytes(MyConfig, len(chunkName(fileHandle, MyConfig, grid, 0, 0, 1, 0)), math.floor(MyConfig["datafileSR"]*chunkSecs))
+    shardRecords = None
+    if MyConfig["recordFormat"] == "tfrecords" and MyConfig["tftype"] != "single":
+        shardRecords = configShardRecords(MyConfig)
 
     examples = 1
     if "examples" in MyConfig : 
         examples = MyConfig["examples"]
 
-    for x in range(examples) :
-        '''Enumerate parameters'''
-        for index in range(len(userParam)): # iterating through a caretesian product of lists
-
-            '''Stepping through enumerated dataset'''
-            userP = userParam[index]
-            synthP = synthParam[index]
-
-            for paramInd in range(len(paramArr)):
-                # if paramArr[paramInd]["synth_units"] == "norm":
-                #     '''Setting in Normal ranges'''
-                #     barsynth.setParamNorm(paramArr[paramInd]["synth_pname"], synthP[paramInd])
-                # else: 
-                '''Setting in natural ranges'''
-                barsynth.setParam(paramArr[paramInd]["synth_pname"], synthP[paramInd])
-            
-            barsig=barsynth.generate(MyConfig["soundDuration"])
-            numChunks=MyConfig["numChunks"]#math.floor(MyConfig["soundDuration"]/MyConfig["chunkSecs"])  #Total duraton DIV duraiton of each chunk 
-            chunkSecs = MyConfig["soundDuration"]/numChunks
-            
-            for chnk in range(numChunks):
-
-                fileHandle = fileHandler()
-
-                if numChunks == 1:
-                    '''Write wav'''
-                    #wavName = fileHandle.makeName(MyConfig["soundname"], paramArr, fixedParams, userP, v)
-                    wavName = fileHandle.makeName(MyConfig["soundname"], paramArr, userP, None, examples, x)
-                    wavPath = fileHandle.makeFullPath(outputpath,wavName,".wav")
-                    chunkedAudio = selectChunk(barsig, MyConfig["computeSR"], chnk, chunkSecs)
-
-                    if MyConfig["computeSR"] != MyConfig["datafileSR"]:
-                        newsig=librosa.resample(chunkedAudio, MyConfig["computeSR"], MyConfig["datafileSR"])
-                        sf.write(wavPath, newsig, MyConfig["datafileSR"])
-                    else:
-                        newsig = chunkedAudio
-                        sf.write(wavPath, chunkedAudio, MyConfig["datafileSR"])
+    workers = 1
+    if "workers" in MyConfig and MyConfig["workers"] != None:
+        workers = max(1, MyConfig["workers"])
 
-                    '''Write params'''
-                    #paramName = fileHandle.makeName(MyConfig["soundname"], paramArr, fixedParams, userP, v)
-                    paramName = fileHandle.makeName(MyConfig["soundname"], paramArr, userP, None, examples, x)
-                    pfName = fileHandle.makeFullPath(outputpath, paramName,".params")
-                else:
-                    wavName = fileHandle.makeName(MyConfig["soundname"], paramArr, userP, chnk, examples, x)
-                    wavPath = fileHandle.makeFullPath(outputpath,wavName,".wav")
-                    chunkedAudio = selectChunk(barsig, MyConfig["computeSR"], chnk, chunkSecs)
-
-                    if MyConfig["computeSR"] != MyConfig["datafileSR"]:
-                        newsig=librosa.resample(chunkedAudio, MyConfig["computeSR"], MyConfig["datafileSR"])
-                        sf.write(wavPath, newsig, MyConfig["datafileSR"], subtype='PCM_16')
-                    else:
-                        newsig = chunkedAudio
-                        sf.write(wavPath, chunkedAudio, MyConfig["datafileSR"], subtype='PCM_16')
+    '''
+        A shard owns a contiguous block of the flat (example x combination x chunk) space.
+        Jobs enumerate the examples x parameter combinations covering that block; results come back in job order.
+    '''
+    chunkStart, chunkEnd = shardRange(examples*len(grid)*numChunks, shardIndex, numShards)
+    jobs = range(chunkStart//numChunks, (chunkEnd+numChunks-1)//numChunks)
+    if numShards > 1:
+        print("Generating shard", shardIndex, "of", numShards, ": chunks", chunkStart, "to", chunkEnd-1)
+
+    '''Chunks completed by earlier runs (with the same content settings) are skipped on resume'''
+    cfgHash = configHash(MyConfig, seed)
+    completed = {}
+    if resume:
+        completed = completedChunks(outputpath, cfgHash, MyConfig["recordFormat"] == "tfrecords")
+
+    '''Array datasets hold one row per chunk of this shard; rows of a resumed run are kept if the layout is unchanged'''
+    arrayw = None
+    if MyConfig["recordFormat"] == "array":
+        layout = {"user_nvals": [p["user_nvals"] for p in paramArr], "examples": examples, "chunkRange": [chunkStart, chunkEnd],
+            "sampling": grid.mode, "samples": len(grid)}
+        arrayw = arrayWriter(outputpath, shardSuffix(shardIndex, numShards), chunkEnd - chunkStart, math.floor(MyConfig["datafileSR"]*chunkSecs),
+            MyConfig["datafileSR"], paramArr, fixedParams, layout, resume)
+        if not arrayw.reused:
+            completed = {}
+    if resume:
+        print("Resuming:", len(completed), "chunks already generated")
+
+    tarw = None
+    if MyConfig["recordFormat"] == "tarshards":
+        tarShardBytes = TARSHARD_BYTES
+        if "tarShardBytes" in MyConfig:
+            tarShardBytes = MyConfig["tarShardBytes"]
+        tarw = tarShardWriter(outputpath, shardSuffix(shardIndex, numShards), tarShardBytes, resume)
+
+    def jobChunks(jobIndex):
+        '''Chunks of a job inside this shard's range; boundary jobs are shared with the neighbouring shard'''
+        return [chnk for chnk in range(numChunks) if chunkStart <= jobIndex*numChunks + chnk < chunkEnd]
+
+    def jobName(jobIndex, chnk):
+        x, index = divmod(jobIndex, len(grid))
+        return chunkName(fileHandle, MyConfig, grid, index, chnk, examples, x)
+
+    def completedName(jobIndex, chnk):
+        '''
+            Name under which an earlier run completed a chunk, or None. Example 0 is also matched under the name it
+            has with the other example count (no --x- suffix with a single example), so changing "examples" keeps it.
+        '''
+        name = jobName(jobIndex, chnk)
+        if name in completed:
+            return name
+        x, index = divmod(jobIndex, len(grid))
+        if x == 0:
+            name = chunkName(fileHandle, MyConfig, grid, index, chnk, 2 if examples == 1 else 1, 0)
+            if name in completed:
+                return name
+        return None
+
+    def jobDone(jobIndex):
+        return all(completedName(jobIndex, chnk) != None for chnk in jobChunks(jobIndex))
+
+    '''Jobs whose chunks (inside this shard) are all completed are not synthesized at all'''
+    todo = (jobIndex for jobIndex in jobs if not jobDone(jobIndex))
+    '''Progress and ETA count the jobs this run synthesizes; carried-over jobs take no time'''
+    numTodo = len(jobs)
+    if len(completed) > 0:
+        numTodo = sum(1 for jobIndex in jobs if not jobDone(jobIndex))
+    numSynthesized = 0
+
+    manifest = runManifest(outputpath, shardIndex, numShards, cfgHash)
+    manifest.open({"soundname": MyConfig["soundname"], "recordFormat": MyConfig["recordFormat"], "rngseed": seed,
+        "params": [p["synth_pname"] for p in paramArr], "chunkRange": [chunkStart, chunkEnd], "nsjson": nsjsonName,
+        "nsjsonStream": nsjsonStreamName, "array": "array" + shardSuffix(shardIndex, numShards) + ".json",
+        "tarshards": "tarshards" + shardSuffix(shardIndex, numShards) + ".json"}, resume)
+
+    '''Output pipeline for wav and param files: writer threads, queue bound and fsync batch size (0: no fsync)'''
+    writerThreads = 4
+    if "writerThreads" in MyConfig and MyConfig["writerThreads"] != None:
+        writerThreads = MyConfig["writerThreads"]
+    writerQueue = 64
+    if "writerQueue" in MyConfig:
+        writerQueue = MyConfig["writerQueue"]
+    fsyncEvery = 0
+    if "fsyncEvery" in MyConfig:
+        fsyncEvery = MyConfig["fsyncEvery"]
+    writer = outputPipeline(writerThreads, writerQueue, fsyncEvery)
+
+    tfwriter = None
+    if MyConfig["recordFormat"] == "tfrecords" and MyConfig["tftype"] != "single":
+        tfwriter = tfShardWriter(tfr, outputpath, paramArr, fixedParams, shardBytes, metrics, shardRecords)
+
+    nsstream = None
+    if MyConfig["recordFormat"] == "nsjson" or MyConfig["recordFormat"] == 1:
+        nsstream = nsjsonStream(sg, outputpath, nsjsonStreamName, {"soundname": MyConfig['soundname'], "sr": MyConfig["datafileSR"],
+            "params": [p["synth_pname"] for p in paramArr]})
+
+    '''Synths with generateBatch are fed blocks of "synthBatch" consecutive jobs (default 16), others one job at a time'''
+    synthBatch = 1
+    if isBatchSynth(barsynth):
+        synthBatch = 16
+        if "synthBatch" in MyConfig:
+            synthBatch = MyConfig["synthBatch"]
+        print("Batch synthesis:", synthBatch, "param settings per generateBatch call")
+
+    def synthResults(batches):
+        '''Job results in order, adding the stage timings of the synthesizing process to this run's metrics'''
+        for batch, stages in batches:
+            metrics.merge(stages)
+            yield from batch
+
+    def recordChunk(chunkIndex, name, paths, userP, synthP):
+        '''Records a chunk written by this run in the manifest and the metrics'''
+        with metrics.stage("manifest"):
+            manifest.addChunk(chunkIndex, name, paths, userP, synthP)
+        metrics.addChunk(chunkSecs)
+
+    pool = None
+    if workers > 1:
+        print("Synthesizing with", workers, "worker processes")
+        pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(MyConfig, seed, grid))
+        '''About two batches per worker are in flight; finished ones wait for the writers, not the other way round'''
+        synthAhead = 2*workers
+        if "synthAhead" in MyConfig:
+            synthAhead = MyConfig["synthAhead"]
+        results = synthResults(imapBounded(pool, synthesizeBatch, batchJobs(todo, synthBatch), synthAhead))
+    else:
+        initWorker(MyConfig, seed, grid)
+        results = synthResults(map(synthesizeBatch, batchJobs(todo, synthBatch)))
 
-                    '''Write params'''
-                    #paramName = fileHandle.makeName(MyConfig["soundname"], paramArr, fixedParams, userP, v)
-                    paramName = fileHandle.makeName(MyConfig["soundname"], paramArr, userP, chnk, examples, x)
-                    pfName = fileHandle.makeFullPath(outputpath, paramName,".params")
+    try:
+        for jobIndex in jobs:
 
+            '''Stepping through enumerated dataset'''
+            x, index = divmod(jobIndex, len(grid))
+            userP, synthP = grid[index]
+
+            if jobDone(jobIndex):
+                synthVals = None
+            else:
+                numSynthesized += 1
+                '''Time spent waiting for synthesized jobs (the synthesis itself, with a single process)'''
+                with metrics.stage("synthWait"):
+                    _, synthVals, chunks = next(results)
+
+            for chnk in jobChunks(jobIndex):
+
+                chunkIndex = jobIndex*numChunks + chnk
+                wavName = jobName(jobIndex, chnk)
+                doneName = completedName(jobIndex, chnk)
+
+                if doneName != None:
+                    '''Carry the completed chunk over, under the name its files have; aggregate records only need its param values'''
+                    record = completed[doneName]
+                    manifest.addCompleted(chunkIndex, record)
+                    if nsstream != None:
+                        with metrics.stage("nsjson"):
+                            nsstream.addRecord(doneName, [p['synth_pname'] for p in paramArr], record["user"], record["synth"])
+                    continue
+
+                newsig = chunks[chnk]
+
+                if arrayw != None:
+                    '''Array datasets keep the audio in the preallocated matrix, without per-chunk files'''
+                    with metrics.stage("array"):
+                        arrayw.add(chunkIndex - chunkStart, newsig, userP, synthVals, chnk, x)
+                    recordChunk(chunkIndex, wavName, [arrayw.audioPath], userP, synthVals)
+                    continue
+
+                if tarw != None:
+                    '''Tar shards hold the encoded wav and the JSON param record; chunks are recorded once their shard is closed'''
+                    wavBytes = io.BytesIO()
+                    with metrics.stage("wav"):
+                        sf.write(wavBytes, newsig, MyConfig["datafileSR"], format="WAV", subtype='PCM_16')
+                    with metrics.stage("tarshards"):
+                        tarw.add((chunkIndex, wavName, userP, synthVals), wavName, wavBytes.getvalue(),
+                            chunkRecord(MyConfig, barsynth, sg, wavName, userP, synthVals, chunkSecs))
+                    for tag, tarPath in tarw.completed():
+                        recordChunk(tag[0], tag[1], [tarPath], tag[2], tag[3])
+                    continue
+
+                '''Write wav'''
+                #wavName = fileHandle.makeName(MyConfig["soundname"], paramArr, fixedParams, userP, v)
+                wavPath = fileHandle.layoutPath(outputpath,wavName,".wav", userP)
+
+                '''Write params (same name as the wav)'''
+                pfName = fileHandle.layoutPath(outputpath, wavName,".params", userP)
+
+                '''Wav and param files are written by the output pipeline; the chunk is recorded once they are on disk'''
+                outputs = [wavPath]
                 if MyConfig["recordFormat"] == "params" or MyConfig["recordFormat"]==0:
-                    pm=paramManager.paramManager(wavPath, fileHandle.getFullPath())
-                    pm.initParamFiles(overwrite=True)
-
-                    '''Write parameters and meta-parameters'''
-                    for pnum in range(len(paramArr)):
-                            #pm.addParam(pfName, paramArr[pnum]['synth_pname'], [0,MyConfig["soundDuration"]], [userP[pnum], userP[pnum]], units=paramArr[pnum]['synth_units'], nvals=paramArr[pnum]['user_nvals'], minval=paramArr[pnum]['user_minval'], maxval=paramArr[pnum]['user_maxval'], origUnits=None, origMinval=paramArr[pnum]['synth_minval'], origMaxval=paramArr[pnum]['synth_maxval'])
-                            pm.addParam(pfName, paramArr[pnum]['synth_pname'], [0,chunkSecs], [userP[pnum], userP[pnum]], units=paramArr[pnum]['synth_units'], nvals=paramArr[pnum]['user_nvals'], minval=paramArr[pnum]['user_minval'], maxval=paramArr[pnum]['user_maxval'], origUnits=None, origMinval=paramArr[pnum]['synth_minval'], origMaxval=paramArr[pnum]['synth_maxval'])
-                            
-                            if "user_doc" in paramArr[pnum] and paramArr[pnum]["user_doc"] != "" :
-                                pm.addMetaParam(pfName, paramArr[pnum]['synth_pname']+"_user_doc",paramArr[pnum]['user_doc']) 
-
-                            pm.addMetaParam(pfName, paramArr[pnum]['synth_pname']+"_synth_doc",barsynth.getParam(paramArr[pnum]["synth_pname"],"synth_doc"))
-                    
-                    for pnum in range(len(fixedParams)):
-                        ######pm.addParam(pfName, fixedParams[pnum]['synth_pname'], [0,MyConfig["soundDuration"]], [fixedParams[pnum]["synth_val"], fixedParams[pnum]["synth_val"]], units=fixedParams[pnum]['synth_units'], nvals=2, origUnits=None)
-                        #pm.addMetaParam(pfName, fixedParams[pnum]['synth_pname']+" (FIXED_VAL)",barsynth.getParam(fixedParams[pnum]["synth_pname"]))
-                        #if "user_doc" in fixedParams[pnum] and fixedParams[pnum]["user_doc"] != "" :
-                        #    pm.addMetaParam(pfName, fixedParams[pnum]['synth_pname']+"_user_doc",fixedParams[pnum]['user_doc']) 
-                        #pm.addMetaParam(pfName, fixedParams[pnum]['synth_pname']+"_synth_doc",barsynth.getParam(fixedParams[pnum]["synth_pname"],"synth_doc"))
-
-                        docstr= f" {barsynth.getParam(fixedParams[pnum]['synth_pname'])}, "
-                        if "user_doc" in fixedParams[pnum] and fixedParams[pnum]["user_doc"] != "" :
-                            docstr=docstr+fixedParams[pnum]['user_doc']+ ", "
-                        docstr=docstr+barsynth.getParam(fixedParams[pnum]["synth_pname"],"synth_doc")
-                        pm.addMetaParam(pfName, "(FIXED_VAL) " + fixedParams[pnum]['synth_pname'], docstr)
+                    outputs.append(pfName)
+                writer.submit((chunkIndex, wavName, outputs, userP, synthVals), writeChunkFiles,
+                    MyConfig, barsynth, newsig, wavPath, fileHandle.getFullPath(), pfName, userP, chunkSecs, metrics)
 
+                if MyConfig["recordFormat"] == "params" or MyConfig["recordFormat"]==0:
+                    '''Param files are written with the wav by the output pipeline'''
+                    pass
 
                 elif MyConfig["recordFormat"] == "nsjson" or MyConfig["recordFormat"] == 1:
                     
-                    sg.storeSingleRecord(wavName)
-                    for pnum in range(len(paramArr)):
-                        sg.addParams(wavName, paramArr[pnum]['synth_pname'], userP[pnum], barsynth.getParam(paramArr[pnum]['synth_pname']))
-                    sg.write2File("nsjson.json")
+                    with metrics.stage("nsjson"):
+                        nsstream.addRecord(wavName, [p['synth_pname'] for p in paramArr], userP, synthVals)
                 
                 elif MyConfig["recordFormat"] == "tfrecords":
 
-                    tfr.__addFeatureData__(pfName, [0, chunkSecs], newsig, chnk)
-                    # MyConfig["shard_size"], MyConfig["samplerate"], totalDuration)
-                    
-                    for pnum in range(len(paramArr)):
-                        # paramArr[pnum]['synth_units'], paramArr[pnum]['user_nvals'], paramArr[pnum]['user_minval'], paramArr[pnum]['user_maxval'], paramArr[pnum]['synth_minval'], paramArr[pnum]['synth_maxval']
-                        tfr.__addParam__(paramArr[pnum], userP[pnum])
-
-                    for pnum in range(len(fixedParams)):
-                        tfr.__addParam__(fixedParams[pnum], fixedParams[pnum]["synth_val"])
-
-                    #print("size is " , tfr.__tfRetSize__())
-                    tfr.__tfUpdateSize__()
-
                     '''Usage of tfrecords with single record per file'''                
                     if MyConfig["tftype"] == "single":                                
-                        tfr.__tfwriteOne__(pfName)
-                        print("Generated a tfrecord")
-                    else:
-
-                        ''' Append and do not write'''
-                        if tfr.__tfRetSize__() < MyConfig["shard_size"] :
-                            #print("new size with record " , tfr.__tfRetSize__())
-                            audioSegments.append(newsig)
-                            pfnames.append(pfName)
-                            soundDurations.append([0,chunkSecs])
-                            segmentNum.append(chnk)
-                            usertfP.append(userP)
-                            synthtfP.append(synthtfP)
-                        else:
-                            ''' Write and then append'''
-                            print(len(pfnames))
-                            tfr.__tfwriteN__(outputpath, pfnames, soundDurations, segmentNum, audioSegments, usertfP, synthtfP, paramArr, fixedParams)
-                            audioSegments = []
-                            pfnames = []
-                            soundDurations = []
-                            segmentNum= []
-                            usertfP = []
-                            synthtfP = []
-                            # afresh with current record
-                            audioSegments.append(newsig)
-                            pfnames.append(pfName)
-                            soundDurations.append([0,chunkSecs])
-                            segmentNum.append(chnk)
-                            usertfP.append(userP)
-                            synthtfP.append(synthtfP)
 
+                        with metrics.stage("tfrecords"):
                             tfr.__addFeatureData__(pfName, [0, chunkSecs], newsig, chnk)
                             # MyConfig["shard_size"], MyConfig["samplerate"], totalDuration)
-                            
+
                             for pnum in range(len(paramArr)):
                                 # paramArr[pnum]['synth_units'], paramArr[pnum]['user_nvals'], paramArr[pnum]['user_minval'], paramArr[pnum]['user_maxval'], paramArr[pnum]['synth_minval'], paramArr[pnum]['synth_maxval']
                                 tfr.__addParam__(paramArr[pnum], userP[pnum])
@@ -367,16 +865,77 @@ def generate(MyConfig):
                                 tfr.__addParam__(fixedParams[pnum], fixedParams[pnum]["synth_val"])
 
                             #print("size is " , tfr.__tfRetSize__())
-                            tfr.__tfUpdateSize__() #might be a problem in edge case when each record is as big as max tfrecord size.
-                            #print("Updated size is " , tfr.__tfRetSize__())
-                        
-                        if index == (len(userParam) - 1) and chnk == (numChunks-1):
-                            print(len(pfnames))
-                            tfr.__tfwriteN__(outputpath, pfnames, soundDurations, segmentNum, audioSegments, usertfP, synthtfP, paramArr, fixedParams)
+                            tfr.__tfUpdateSize__()
+
+                            tfr.__tfwriteOne__(pfName)
+                        manifest.addTfshard([pfName], [tfrecordPath(pfName)])
+                        print("Generated a tfrecord")
+                    else:
+                        '''Shards are cut by size and written in the background'''
+                        with metrics.stage("tfrecords"):
+                            tfwriter.add(pfName, [0,chunkSecs], newsig, chnk, userP, synthP)
+                        for pfnames, files in tfwriter.completed():
+                            manifest.addTfshard(pfnames, files)
 
                 else:
                     print("Not recognized format")
 
+            for tag in writer.completed():
+                recordChunk(*tag)
+            metrics.progress(numSynthesized, numTodo)
+
+        if nsstream != None:
+            nsstream.close()
+            if nsjsonMode != "jsonl":
+                with metrics.stage("nsjson"):
+                    finalizeNsjson([nsstream.path], os.path.join(outputpath, nsjsonName))
+
+        writer.close()
+        for tag in writer.completed():
+            recordChunk(*tag)
+
+        if arrayw != None:
+            arrayw.close()
+
+        if tarw != None:
+            tarw.close()
+            for tag, tarPath in tarw.completed():
+                recordChunk(tag[0], tag[1], [tarPath], tag[2], tag[3])
+
+        '''Write the last, partial shard'''
+        if tfwriter != None:
+            tfwriter.close()
+            for pfnames, files in tfwriter.completed():
+                manifest.addTfshard(pfnames, files)
+        manifest.close()
+
+        '''Run report: stage timings (summed over worker processes and threads), throughput and bytes on disk'''
+        metrics.progress(numTodo, numTodo, force=True)
+        report = metrics.report(outputpath)
+        report["workers"] = workers
+        report["recordFormat"] = MyConfig["recordFormat"]
+        report["jobs"] = len(jobs)
+        metrics.write(os.path.join(outputpath, "metrics" + shardSuffix(shardIndex, numShards) + ".json"), report)
+        metrics.printReport(report)
+
+    finally:
+        '''All results are consumed on success, so terminating only cuts short a failed run'''
+        if pool != None:
+            pool.terminate()
+            pool.join()
+        writer.abort()
+        '''A failed run leaves its manifest without the closing line, marking the shard for a re-run'''
+        if manifest.f != None:
+            '''Chunks (and tfrecord shards) written before the failure are still recorded, so --resume keeps them'''
+            for tag in writer.completed(checkError=False):
+                recordChunk(*tag)
+            if tfwriter != None:
+                for pfnames, files in tfwriter.completed():
+                    manifest.addTfshard(pfnames, files)
+            manifest.f.close()
+        if nsstream != None:
+            nsstream.close()
+
     # if MyConfig["recordFormat"] == "tfrecords" and MyConfig["tftype"] == "shards":
 
     #     tfr=tfrecordManager.tfrecordManager()
@@ -0,0 +1,153 @@
+# Append-only manifest of the outputs of a dataset run (or of one shard of it).
+# One JSON object per line: a header, one record per written chunk, and a closing "done" line.
+import glob
+import hashlib
+import json
+import os
+
+def shardSuffix(shardIndex, numShards):
+    '''File-name suffix for the outputs of one shard, empty for an unsharded run'''
+    if numShards <= 1:
+        return ""
+    return '-shard-{:05}-of-{:05}'.format(shardIndex, numShards)
+
+def shardRange(total, shardIndex, numShards):
+    '''Contiguous [start, end) block of a flat job space owned by one shard'''
+    if shardIndex < 0 or shardIndex >= numShards:
+        raise ValueError("shard index " + str(shardIndex) + " is not in [0, " + str(numShards) + ")")
+    return total*shardIndex//numShards, total*(shardIndex+1)//numShards
+
+def configHash(MyConfig, seed):
+    '''
+        Hash of the settings that determine the content of an output file.
+        The grid shape (user_nvals, examples, samples) and the run layout (shards, workers) are left out,
+        so that extending a grid, or a uniform or sobol sample set, keeps the outputs that already exist.
+    '''
+    keys = ["soundname", "computeSR", "datafileSR", "soundDuration", "numChunks", "recordFormat", "tftype", "fixedParams"]
+    settings = {k: MyConfig[k] for k in keys if k in MyConfig}
+    settings["params"] = [{k: v for k, v in p.items() if k != "user_nvals"} for p in MyConfig["params"]]
+    settings["rngseed"] = seed
+    '''Job seeds come from the example number and param setting (generate.jobSeed); runs seeded by flat job index do not match'''
+    settings["jobSeeds"] = "setting"
+    if "sampling" in MyConfig and MyConfig["sampling"] != None and MyConfig["sampling"] != "grid":
+        settings["sampling"] = MyConfig["sampling"]
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def readManifest(path):
+    '''Returns the header, the chunk records, the tfrecord shard entries and whether the run completed'''
+    header = None
+    records = []
+    tfshards = []
+    done = False
+    with open(path) as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                '''A run killed mid-write can leave a partial last line'''
+                break
+            if entry["type"] == "header":
+                '''Resumed runs append a new header; only the last run decides completion'''
+                header = entry
+                done = False
+            elif entry["type"] == "chunk":
+                records.append(entry)
+            elif entry["type"] == "tfshard":
+                tfshards.append(entry)
+            elif entry["type"] == "done":
+                done = True
+    return header, records, tfshards, done
+
+def previousSeed(outputpath):
+    '''Seed recorded by the last run in outputpath, or None'''
+    seed = None
+    for path in sorted(glob.glob(os.path.join(outputpath, "manifest*.jsonl"))):
+        header = readManifest(path)[0]
+        if header != None:
+            seed = header["rngseed"]
+    return seed
+
+def completedChunks(outputpath, cfgHash, tfrecords=False):
+    '''
+        Chunk records of earlier runs in outputpath (any shard) made with the same config hash,
+        whose outputs all exist with the recorded sizes. For tfrecords, the chunk must also be in a written shard.
+        Returns a dict from chunk name to record.
+    '''
+    done = {}
+    tfdone = set()
+    for path in sorted(glob.glob(os.path.join(outputpath, "manifest*.jsonl"))):
+        header, records, tfshards, _ = readManifest(path)
+        for r in records:
+            if r["config"] == cfgHash:
+                done[r["name"]] = r
+        for t in tfshards:
+            if t["config"] == cfgHash:
+                tfdone.update(t["names"])
+
+    for name in list(done.keys()):
+        r = done[name]
+        for p, size in zip(r["paths"], r["sizes"]):
+            fullpath = os.path.join(outputpath, p)
+            if not os.path.isfile(fullpath) or os.path.getsize(fullpath) != size:
+                del done[name]
+                break
+        if tfrecords and name in done and not name in tfdone:
+            del done[name]
+    return done
+
+class runManifest():
+
+    def __init__(self, outputpath, shardIndex=0, numShards=1, cfgHash=None):
+
+        self.outputpath = outputpath
+        self.cfgHash = cfgHash
+        self.shardIndex = shardIndex
+        self.numShards = numShards
+        self.fname = "manifest" + shardSuffix(shardIndex, numShards) + ".jsonl"
+        self.path = os.path.join(outputpath, self.fname)
+        self.numRecords = 0
+        self.f = None
+
+    def open(self, header, resume=False):
+        '''Starts the manifest afresh (a re-run shard replaces its previous manifest), or appends a new run to it'''
+        self.f = open(self.path, "a" if resume else "w")
+        header = dict(header)
+        header["type"] = "header"
+        header["config"] = self.cfgHash
+        header["shardIndex"] = self.shardIndex
+        header["numShards"] = self.numShards
+        self.__append__(header)
+
+    def relPath(self, path):
+        return os.path.relpath(path, self.outputpath)
+
+    def addChunk(self, chunkIndex, name, paths, userP, synthP):
+        '''Records one written chunk: its flat chunk index, name, output paths and sizes, and param values'''
+        self.__append__({"type": "chunk", "chunkIndex": chunkIndex, "name": name,
+            "paths": [self.relPath(p) for p in paths], "sizes": [os.path.getsize(p) for p in paths],
+            "user": [float(v) for v in userP], "synth": [float(v) for v in synthP], "config": self.cfgHash})
+        self.numRecords += 1
+
+    def addCompleted(self, chunkIndex, record):
+        '''Carries a chunk completed by an earlier run over into this run, under its current chunk index'''
+        record = dict(record)
+        record["chunkIndex"] = chunkIndex
+        self.__append__(record)
+        self.numRecords += 1
+
+    def addTfshard(self, pfnames, files):
+        '''Records the chunks (by name) written together into one tfrecord shard, and the tfrecord file(s) holding them'''
+        self.__append__({"type": "tfshard", "names": [os.path.splitext(os.path.basename(p))[0] for p in pfnames],
+            "files": [self.relPath(p) for p in files], "config": self.cfgHash})
+
+    def close(self):
+        self.__append__({"type": "done", "numRecords": self.numRecords})
+        self.f.close()
+        self.f = None
+
+    def __append__(self, entry):
+        '''Each line is flushed, so a killed run leaves a readable prefix'''
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
@@ -0,0 +1,119 @@
+# Combines the outputs of a sharded dataset run (generate.py --shard-index i --num-shards N)
+# into one dataset index: index.json, plus a single nsjson.json for nsjson runs.
+import argparse
+import glob
+import json
+import os
+import sys
+
+from manifest import readManifest
+from nsjsonstream import finalizeNsjson
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Merge the shard manifests of a dataset run")
+    parser.add_argument("--outputpath", required=True)
+    parser.add_argument("--num-shards", type=int, default=None, help="expected number of shards (default: read from the manifests)")
+    return parser.parse_args()
+
+def mergeNsjson(outputpath, fnames):
+    '''Concatenates the per-shard nsjson documents, in shard order'''
+    merged = None
+    for fname in fnames:
+        with open(os.path.join(outputpath, fname)) as f:
+            doc = json.load(f)
+        if merged == None:
+            merged = doc
+        elif isinstance(merged, list):
+            merged.extend(doc)
+        else:
+            merged.update(doc)
+    return merged
+
+def merge(outputpath, numShards=None):
+    '''
+        Checks that every shard finished, then writes index.json with all chunk records in flat chunk order,
+        the tfrecord files and the merged nsjson file. Returns the indices of shards that need a re-run.
+    '''
+    paths = sorted(glob.glob(os.path.join(outputpath, "manifest-shard-*-of-*.jsonl")))
+    if len(paths) == 0:
+        paths = glob.glob(os.path.join(outputpath, "manifest.jsonl"))
+    if len(paths) == 0:
+        print("No manifest found in", outputpath)
+        return None
+
+    shards = {}
+    for path in paths:
+        header, records, tfshards, done = readManifest(path)
+        if header == None:
+            continue
+        if numShards == None:
+            numShards = header["numShards"]
+        if header["numShards"] != numShards:
+            print("Ignoring", path, ": written for", header["numShards"], "shards, expected", numShards)
+            continue
+        shards[header["shardIndex"]] = (header, records, tfshards, done)
+
+    failed = [i for i in range(numShards) if not i in shards or not shards[i][3]]
+    if len(failed) > 0:
+        return failed
+
+    headers = [shards[i][0] for i in range(numShards)]
+    '''Resumed runs may record a chunk more than once; the latest record wins'''
+    byName = {}
+    tfshards = set()
+    tffiles = set()
+    for i in range(numShards):
+        for r in shards[i][1]:
+            byName[r["name"]] = r
+        for t in shards[i][2]:
+            tfshards.add(tuple(t["names"]))
+            tffiles.update(t.get("files", []))
+    records = sorted(byName.values(), key=lambda r: r["chunkIndex"])
+
+    index = {
+        "soundname": headers[0]["soundname"],
+        "recordFormat": headers[0]["recordFormat"],
+        "rngseed": headers[0]["rngseed"],
+        "params": headers[0]["params"],
+        "numShards": numShards,
+        "numRecords": len(records),
+        "records": [{"chunkIndex": r["chunkIndex"], "name": r["name"], "paths": r["paths"], "sizes": r["sizes"], "user": r["user"], "synth": r["synth"]} for r in records],
+    }
+
+    if headers[0]["recordFormat"] == "tfrecords":
+        '''The tfrecord files recorded by the runs (in any layout directory), not whatever *.tfrecord files are lying around'''
+        index["tfrecords"] = sorted(p for p in tffiles if os.path.isfile(os.path.join(outputpath, p)))
+        index["numTfshards"] = len(tfshards)
+
+    if headers[0]["recordFormat"] == "tarshards":
+        index["tarshards"] = [h["tarshards"] for h in headers]
+
+    if headers[0]["recordFormat"] == "array":
+        index["arrays"] = [h["array"] for h in headers]
+
+    if headers[0]["recordFormat"] == "nsjson" or headers[0]["recordFormat"] == 1:
+        if all("nsjsonStream" in h for h in headers):
+            '''Streamed shards are merged record by record'''
+            finalizeNsjson([os.path.join(outputpath, h["nsjsonStream"]) for h in headers], os.path.join(outputpath, "nsjson.json"))
+        else:
+            merged = mergeNsjson(outputpath, [h["nsjson"] for h in headers])
+            with open(os.path.join(outputpath, "nsjson.json"), "w") as f:
+                json.dump(merged, f)
+        index["nsjson"] = "nsjson.json"
+
+    with open(os.path.join(outputpath, "index.json"), "w") as f:
+        json.dump(index, f)
+    print("Merged", numShards, "shards,", len(records), "records into", os.path.join(outputpath, "index.json"))
+    return []
+
+def main():
+    args = get_arguments()
+    failed = merge(args.outputpath, args.num_shards)
+    if failed == None:
+        sys.exit(1)
+    if len(failed) > 0:
+        print("Shards missing or incomplete, re-run them with --shard-index:", failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Run metrics: per-stage timings, throughput, progress and the metrics.json report of a generation run.
+import contextlib
+import json
+import os
+import threading
+import time
+
+def formatSecs(secs):
+    secs = int(secs)
+    return '{}:{:02}:{:02}'.format(secs//3600, secs//60 % 60, secs % 60)
+
+class runMetrics():
+    '''
+        Cumulative wall time, CPU time (of the timing thread) and call count per named stage, plus chunk and
+        audio-second counters. Stages may be timed from several threads; worker processes keep their own
+        instance and hand its stages to the parent with drain(), which merge() adds in.
+    '''
+
+    def __init__(self, interval=5.0):
+
+        self.stages = {}
+        self.chunks = 0
+        self.audioSecs = 0.0
+        self.lock = threading.Lock()
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.startCpu = time.process_time()
+        self.lastProgress = self.start
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''Times the enclosed block as one call of stage name'''
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add(self, name, wall, cpu, calls=1):
+        with self.lock:
+            if not name in self.stages:
+                self.stages[name] = {"wall": 0.0, "cpu": 0.0, "calls": 0}
+            entry = self.stages[name]
+            entry["wall"] += wall
+            entry["cpu"] += cpu
+            entry["calls"] += calls
+
+    def drain(self):
+        '''Returns (and resets) the stage timings gathered since the last call'''
+        with self.lock:
+            stages = self.stages
+            self.stages = {}
+        return stages
+
+    def merge(self, stages):
+        for name, entry in stages.items():
+            self.add(name, entry["wall"], entry["cpu"], entry["calls"])
+
+    def addChunk(self, secs):
+        '''Counts one chunk written by this run, of secs seconds of audio'''
+        with self.lock:
+            self.chunks += 1
+            self.audioSecs += secs
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def progress(self, done, total, force=False):
+        '''Prints progress and the ETA of done out of total jobs, at most once per interval seconds'''
+        now = time.perf_counter()
+        if not force and now - self.lastProgress < self.interval:
+            return
+        self.lastProgress = now
+        elapsed = now - self.start
+        eta = elapsed/done*(total - done) if done > 0 else 0
+        print("Progress: {}/{} jobs ({:.1f}%), {:.1f} files/s, {:.1f} audio-s/s, elapsed {}, ETA {}".format(
+            done, total, 100.0*done/max(total, 1), self.chunks/max(elapsed, 1e-9), self.audioSecs/max(elapsed, 1e-9),
+            formatSecs(elapsed), formatSecs(eta)), flush=True)
+
+    def report(self, outputpath=None):
+        '''
+            Machine-readable summary of the run. With outputpath, bytes on disk are added per file extension
+            (".wav", ".params", ".tfrecord", ".npy", ".tar", ".json", ".jsonl"), over the whole output tree.
+        '''
+        elapsed = self.elapsed()
+        with self.lock:
+            report = {
+                "wallSecs": elapsed,
+                "cpuSecs": time.process_time() - self.startCpu,
+                "chunks": self.chunks,
+                "audioSecs": self.audioSecs,
+                "filesPerSec": self.chunks/max(elapsed, 1e-9),
+                "audioSecsPerSec": self.audioSecs/max(elapsed, 1e-9),
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+            }
+        if outputpath != None:
+            report["bytes"] = bytesOnDisk(outputpath)
+        return report
+
+    def write(self, path, report):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+
+    def printReport(self, report):
+        print("Run time", formatSecs(report["wallSecs"]), "-", report["chunks"], "chunks,",
+            '{:.1f} files/s, {:.1f} audio-s/s'.format(report["filesPerSec"], report["audioSecsPerSec"]))
+        for name, entry in sorted(report["stages"].items(), key=lambda item: -item[1]["wall"]):
+            print('    {:<12} wall {:>10.2f}s  cpu {:>10.2f}s  calls {:>8}'.format(name, entry["wall"], entry["cpu"], entry["calls"]))
+        if "bytes" in report:
+            for ext, nbytes in sorted(report["bytes"].items()):
+                print('    {:<12} {:>14} bytes'.format(ext, nbytes))
+
+def bytesOnDisk(outputpath):
+    '''Total size of the files under outputpath, by extension'''
+    sizes = {}
+    for dirpath, dirnames, filenames in os.walk(outputpath):
+        for fname in filenames:
+            ext = os.path.splitext(fname)[1]
+            try:
+                sizes[ext] = sizes.get(ext, 0) + os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass
+    return sizes
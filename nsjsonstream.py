@@ -0,0 +1,67 @@
+# Streaming nsjson output.
+# Records are appended to a JSON Lines file as they are produced, instead of rewriting the whole nsjson document per chunk.
+import json
+import os
+
+def dumpCompact(obj):
+    return json.dumps(obj, separators=(",", ":"), default=float)
+
+def finalizeNsjson(jsonlPaths, outPath):
+    '''Writes the classic single-document nsjson file from one or more record streams, in one pass, one record at a time'''
+    with open(outPath, "w") as out:
+        out.write("{")
+        first = True
+        for path in jsonlPaths:
+            with open(path) as f:
+                f.readline() # header
+                for line in f:
+                    if line.strip() == "":
+                        continue
+                    entry = json.loads(line)
+                    if not first:
+                        out.write(", ")
+                    out.write(json.dumps(entry["name"]) + ": " + json.dumps(entry["record"]))
+                    first = False
+        out.write("}")
+
+'''Attribute of an nsjson.nsJson instance holding its records, keyed by name'''
+NSJSON_RECORDS = "data"
+
+def makeRecord(sg, name, pnames, userP, synthP):
+    '''
+        Builds one nsjson record with an nsjson.nsJson instance and takes it back out of the instance's records
+        (sg.data), so that the instance never accumulates records
+    '''
+    records = getattr(sg, NSJSON_RECORDS, None)
+    if not isinstance(records, dict):
+        raise TypeError("nsJson instance does not keep its records in a dict attribute ." + NSJSON_RECORDS)
+    sg.storeSingleRecord(name)
+    for pnum in range(len(pnames)):
+        sg.addParams(name, pnames[pnum], userP[pnum], synthP[pnum])
+    if not name in records:
+        raise TypeError("nsJson instance did not store record " + name + " in ." + NSJSON_RECORDS)
+    return records.pop(name)
+
+class nsjsonStream():
+    '''
+        Append-only nsjson writer. Each record is built by an nsjson.nsJson instance, so it has the same content as
+        in the classic document, then taken out of that instance and written as one line after a compact header line.
+        Memory and I/O per record stay constant.
+    '''
+
+    def __init__(self, sg, outputpath, fname, header):
+
+        self.sg = sg
+        self.path = os.path.join(outputpath, fname)
+        self.numRecords = 0
+        self.f = open(self.path, "w")
+        header = dict(header)
+        header["format"] = "nsjson-stream"
+        self.f.write(dumpCompact(header) + "\n")
+
+    def addRecord(self, name, pnames, userP, synthP):
+        self.f.write(dumpCompact({"name": name, "record": makeRecord(self.sg, name, pnames, userP, synthP)}) + "\n")
+        self.numRecords += 1
+
+    def close(self):
+        self.f.close()
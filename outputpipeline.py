@@ -0,0 +1,111 @@
+# Asynchronous output stage.
+# Audio encoding and param/meta file writes run on a thread pool fed through a bounded queue,
+# so that synthesis does not wait for the disk and the disk does not wait for synthesis.
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class outputPipeline():
+    '''
+        Runs write tasks on numThreads threads. submit() blocks while maxPending tasks are queued or running
+        (backpressure, so memory stays bounded). A task returns the paths it wrote; these are fsynced in batches
+        of fsyncEvery files (0 disables fsync). Each task carries a tag, handed back by completed() once the task
+        has finished, e.g. to record it in the manifest. The first error of a task is raised from the next
+        submit() or close(), or from completed() once the finished tags are handed back, and no further tasks are started.
+        With numThreads == 0 tasks run inline in the calling thread.
+    '''
+
+    def __init__(self, numThreads=4, maxPending=64, fsyncEvery=0):
+
+        self.numThreads = numThreads
+        self.fsyncEvery = fsyncEvery
+        self.executor = None
+        if numThreads > 0:
+            self.executor = ThreadPoolExecutor(max_workers=numThreads, thread_name_prefix="writer")
+        self.slots = threading.BoundedSemaphore(max(1, maxPending))
+        self.lock = threading.Lock()
+        self.done = []
+        self.unsynced = []
+        self.error = None
+
+    def submit(self, tag, fn, *args):
+        self.__checkError__()
+        if self.executor == None:
+            self.__finish__(tag, self.__run__(fn, args))
+            return
+        self.slots.acquire()
+        self.__checkError__()
+        future = self.executor.submit(self.__run__, fn, args)
+        future.add_done_callback(lambda f: self.__finished__(tag, f))
+
+    def completed(self, checkError=True):
+        '''
+            Returns (and forgets) the tags of the tasks finished since the last call. Finished tags are handed back
+            even after a task failed; the error is raised once there are none left (unless checkError is False).
+        '''
+        with self.lock:
+            done = self.done
+            self.done = []
+        if len(done) == 0 and checkError:
+            self.__checkError__()
+        return done
+
+    def close(self):
+        '''Waits for all pending writes, fsyncs the remaining files and shuts the threads down'''
+        if self.executor != None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.__checkError__()
+        self.__fsync__(self.__takeUnsynced__(0))
+
+    def abort(self):
+        '''Stops after the tasks already running, dropping queued ones (used when the run fails)'''
+        if self.executor != None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def __run__(self, fn, args):
+        if self.error != None:
+            return None
+        paths = fn(*args)
+        if self.fsyncEvery > 0:
+            self.__fsync__(self.__takeUnsynced__(self.fsyncEvery, paths))
+        return paths
+
+    def __finished__(self, tag, future):
+        try:
+            if not future.cancelled() and future.exception() != None:
+                with self.lock:
+                    if self.error == None:
+                        self.error = future.exception()
+            elif not future.cancelled():
+                self.__finish__(tag, future.result())
+        finally:
+            self.slots.release()
+
+    def __finish__(self, tag, paths):
+        if paths != None:
+            with self.lock:
+                self.done.append(tag)
+
+    def __takeUnsynced__(self, batch, paths=[]):
+        '''Adds paths to the unsynced list and returns a batch of files to fsync once batch files are pending'''
+        with self.lock:
+            self.unsynced.extend(paths)
+            if len(self.unsynced) < batch or len(self.unsynced) == 0:
+                return []
+            unsynced = self.unsynced
+            self.unsynced = []
+        return unsynced
+
+    def __fsync__(self, paths):
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def __checkError__(self):
+        if self.error != None:
+            raise RuntimeError("output writer failed") from self.error
@@ -0,0 +1,140 @@
+# Lazy cartesian parameter grid, and sampled alternatives to it.
+# Decodes a flat combination index into user and synth values without materializing itertools.product.
+import numpy as np
+
+class paramGrid():
+    '''
+        Cartesian grid over the swept "params" of a config, addressed by flat index.
+        Combinations are ordered as itertools.product over the linspace ranges (the last param varies fastest),
+        and grid[i] returns the (userP, synthP) tuples of combination i.
+        Supports len(), random access and slicing; a slice is again a lazy paramGrid.
+    '''
+
+    '''Grid combinations are named by their param values alone'''
+    mode = "grid"
+    sampled = False
+
+    def __init__(self, paramArr, indices=None):
+
+        self.paramArr = paramArr
+
+        '''Only the per-param value lists are kept, the grid itself is never enumerated'''
+        self.userRange = []
+        self.synthRange = []
+        for p in paramArr:
+            self.userRange.append(np.linspace(p["user_minval"], p["user_maxval"], p["user_nvals"], endpoint=True))
+            self.synthRange.append(np.linspace(p["synth_minval"], p["synth_maxval"], p["user_nvals"], endpoint=True))
+
+        self.radix = [p["user_nvals"] for p in paramArr]
+        self.size = 1
+        for r in self.radix:
+            self.size = self.size*r
+
+        self.indices = range(self.size) if indices is None else indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return paramGrid(self.paramArr, self.indices[key])
+        return self.decode(self.indices[key])
+
+    def __iter__(self):
+        for flatIndex in self.indices:
+            yield self.decode(flatIndex)
+
+    def digits(self, flatIndex):
+        '''Mixed-radix digits of a flat index into the full grid, one value index per param'''
+        if flatIndex < 0 or flatIndex >= self.size:
+            raise IndexError("grid index out of range")
+        digits = [0]*len(self.radix)
+        for pnum in reversed(range(len(self.radix))):
+            flatIndex, digits[pnum] = divmod(flatIndex, self.radix[pnum])
+        return digits
+
+    def decode(self, flatIndex):
+        '''Returns the (userP, synthP) tuples of a flat index into the full grid'''
+        digits = self.digits(flatIndex)
+        userP = tuple(self.userRange[pnum][d] for pnum, d in enumerate(digits))
+        synthP = tuple(self.synthRange[pnum][d] for pnum, d in enumerate(digits))
+        return userP, synthP
+
+'''Sampling modes of the "sampling" config entry'''
+SAMPLING_MODES = ["grid", "uniform", "latin_hypercube", "sobol"]
+
+def unitToParams(paramArr, point):
+    '''Maps a point of the unit cube to (userP, synthP) with the same linear user->synth range mapping as the grid'''
+    userP = tuple(p["user_minval"] + u*(p["user_maxval"] - p["user_minval"]) for p, u in zip(paramArr, point))
+    synthP = tuple(p["synth_minval"] + u*(p["synth_maxval"] - p["synth_minval"]) for p, u in zip(paramArr, point))
+    return userP, synthP
+
+class paramSampler():
+    '''
+        numSamples parameter settings drawn from the unit cube of the swept params by "uniform" random sampling,
+        "latin_hypercube" or scrambled "sobol" sequences, all determined by seed. Same interface as paramGrid:
+        sampler[i] returns the (userP, synthP) tuples of sample i, and slices are lazy views.
+        Uniform samples are drawn per index; the other modes draw all unit points (numSamples x params) at once.
+        Uniform and sobol samples do not depend on numSamples, so raising it extends the dataset; latin_hypercube
+        strata do, so every sample changes with it.
+    '''
+
+    '''Sample values are not unique once formatted, so sample names also carry the sample index'''
+    sampled = True
+
+    def __init__(self, paramArr, mode, numSamples, seed, indices=None, points=None):
+
+        if not mode in SAMPLING_MODES or mode == "grid":
+            raise ValueError("unknown sampling mode " + str(mode) + ", expected one of " + str(SAMPLING_MODES[1:]))
+        self.paramArr = paramArr
+        self.mode = mode
+        self.size = numSamples
+        self.seed = seed
+        self.indices = range(numSamples) if indices is None else indices
+
+        self.points = points
+        if self.points is None and mode != "uniform":
+            from scipy.stats import qmc
+            if mode == "latin_hypercube":
+                engine = qmc.LatinHypercube(d=len(paramArr), seed=np.random.default_rng(seed))
+            else:
+                engine = qmc.Sobol(d=len(paramArr), scramble=True, seed=np.random.default_rng(seed))
+            self.points = engine.random(numSamples)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return paramSampler(self.paramArr, self.mode, self.size, self.seed, self.indices[key], self.points)
+        return self.decode(self.indices[key])
+
+    def __iter__(self):
+        for flatIndex in self.indices:
+            yield self.decode(flatIndex)
+
+    def unitPoint(self, flatIndex):
+        if flatIndex < 0 or flatIndex >= self.size:
+            raise IndexError("sample index out of range")
+        if self.mode == "uniform":
+            '''Spawn key (index, 0): disjoint from the (example, setting hash + 1) keys that seed each job (generate.jobSeed)'''
+            return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(flatIndex, 0))).random(len(self.paramArr))
+        return self.points[flatIndex]
+
+    def decode(self, flatIndex):
+        '''Returns the (userP, synthP) tuples of sample flatIndex'''
+        return unitToParams(self.paramArr, self.unitPoint(flatIndex))
+
+def makeParamGrid(MyConfig, seed):
+    '''
+        Parameter settings of a config: the full cartesian grid (default "sampling": "grid"), or "samples"
+        settings drawn with the "uniform", "latin_hypercube" or "sobol" sampling mode.
+    '''
+    mode = "grid"
+    if "sampling" in MyConfig and MyConfig["sampling"] != None:
+        mode = MyConfig["sampling"]
+    if mode == "grid":
+        return paramGrid(MyConfig["params"])
+    if not "samples" in MyConfig or MyConfig["samples"] == None:
+        raise ValueError("sampling mode " + str(mode) + " needs a \"samples\" count in the config")
+    return paramSampler(MyConfig["params"], mode, MyConfig["samples"], seed)
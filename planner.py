@@ -0,0 +1,221 @@
+# Dry-run planner (generate.py --plan).
+# Works out what a config will produce and how long it will take, and validates it, without writing the dataset.
+import json
+import math
+import os
+import shutil
+import time
+
+import generate
+from filewrite import fileHandler
+from manifest import shardRange
+from paramgrid import makeParamGrid
+from tfshardwriter import recordBytes, configShardBytes
+from tarshards import TARSHARD_BYTES
+
+FORMATS = ["params", "nsjson", "tfrecords", "array", "tarshards"]
+
+'''Numeric recordFormat aliases accepted by generate()'''
+FORMAT_ALIASES = {0: "params", 1: "nsjson"}
+
+REQUIRED_KEYS = ["soundname", "soundDuration", "numChunks", "computeSR", "datafileSR", "recordFormat", "params", "fixedParams"]
+
+def tarMemberBytes(size):
+    '''A tar member takes a 512 byte header plus its data padded to 512 bytes'''
+    return 512 + 512*math.ceil(size/512)
+
+def paramRecord(MyConfig, barsynth, name, userP, synthP, chunkSecs):
+    '''Stand-in for the param record of one chunk (as in .params files and tar shards), to size it'''
+    def doc(pname):
+        try:
+            return barsynth.getParam(pname, "synth_doc")
+        except Exception:
+            return ""
+    record = {"name": name, "soundDuration": [0, chunkSecs], "params": {}, "fixedParams": {}}
+    for pnum, p in enumerate(MyConfig["params"]):
+        record["params"][p["synth_pname"]] = {"user": float(userP[pnum]), "synth": float(synthP[pnum]), "units": "natural",
+            "nvals": p.get("user_nvals", 0), "minval": p["user_minval"], "maxval": p["user_maxval"],
+            "origMinval": p["synth_minval"], "origMaxval": p["synth_maxval"], "user_doc": p.get("user_doc", ""),
+            "synth_doc": doc(p["synth_pname"])}
+    for p in MyConfig["fixedParams"]:
+        record["fixedParams"][p["synth_pname"]] = {"value": p["synth_val"], "user_doc": p.get("user_doc", ""),
+            "synth_doc": doc(p["synth_pname"])}
+    return record
+
+def estimateOutputs(MyConfig, numRecords, chunkSamples, name, record):
+    '''Estimated number of files and bytes written by each record format for numRecords chunks'''
+    numParams = len(MyConfig["params"])
+    wavBytes = 44 + 2*chunkSamples
+    recordJson = len(json.dumps(record))
+    nsjsonRecord = len(json.dumps({name: {pname: {"user": v["user"], "synth": v["synth"]} for pname, v in record["params"].items()}}))
+
+    estimates = {}
+    estimates["params"] = {"files": 2*numRecords, "bytes": numRecords*(wavBytes + recordJson)}
+    estimates["nsjson"] = {"files": numRecords + 2, "bytes": numRecords*(wavBytes + 2*nsjsonRecord)}
+
+    tfBytes = numRecords*recordBytes(len(name), chunkSamples, numParams + len(MyConfig["fixedParams"]))
+    shardBytes = configShardBytes(MyConfig, len(name), chunkSamples)
+    tfFiles = numRecords if "tftype" in MyConfig and MyConfig["tftype"] == "single" else math.ceil(tfBytes/shardBytes)
+    estimates["tfrecords"] = {"files": numRecords + tfFiles, "bytes": numRecords*wavBytes + tfBytes}
+
+    estimates["array"] = {"files": 3, "bytes": numRecords*(4*chunkSamples + 8*(2*numParams + 2)) + 256 + len(json.dumps(MyConfig["params"]))}
+
+    tarShardBytes = TARSHARD_BYTES
+    if "tarShardBytes" in MyConfig:
+        tarShardBytes = MyConfig["tarShardBytes"]
+    tarBytes = numRecords*(tarMemberBytes(wavBytes) + tarMemberBytes(recordJson))
+    '''Each shard ends with two zero blocks and is padded to a 10240 byte record'''
+    numTars = math.ceil(tarBytes/tarShardBytes)
+    estimates["tarshards"] = {"files": numTars + 1, "bytes": tarBytes + 10240*numTars}
+
+    '''Every format also writes the run manifest, one line per chunk'''
+    manifestLine = len(name) + 60*numParams + 200
+    for estimate in estimates.values():
+        estimate["files"] += 1
+        estimate["bytes"] += numRecords*manifestLine
+    return estimates
+
+def validateSynth(MyConfig, seed, problems):
+    '''Instantiates the synth and checks that every swept and fixed synth_pname can be set (at its range ends) and read back'''
+    try:
+        generate.loadSoundModels(MyConfig)
+        barsynthclass = getattr(generate.soundModels["sound"], MyConfig["soundname"])
+        barsynth = barsynthclass(sr=MyConfig["computeSR"], rngseed=seed)
+    except Exception as e:
+        problems.append("cannot load synth " + str(MyConfig["soundname"]) + ": " + repr(e))
+        return None
+    checks = [(p["synth_pname"], p["synth_minval"]) for p in MyConfig["params"]]
+    checks += [(p["synth_pname"], p["synth_maxval"]) for p in MyConfig["params"]]
+    checks += [(p["synth_pname"], p["synth_val"]) for p in MyConfig["fixedParams"]]
+    for pname, value in checks:
+        try:
+            barsynth.setParam(pname, value)
+            barsynth.getParam(pname)
+        except Exception as e:
+            problems.append("synth_pname " + str(pname) + " (value " + str(value) + ") is not valid for " + MyConfig["soundname"] + ": " + repr(e))
+    return barsynth
+
+def timeJobs(MyConfig, seed, grid, jobs, numTimed):
+    '''Seconds per job (synthesis, resampling, chunking) over numTimed jobs spread evenly over the run'''
+    if len(jobs) == 0 or numTimed <= 0:
+        return None
+    numTimed = min(numTimed, len(jobs))
+    sampled = sorted(set(jobs[(i*(len(jobs)-1))//max(1, numTimed-1)] for i in range(numTimed)))
+    '''The long-signal cache is left out, so that planning neither writes nor reads cached signals'''
+    config = dict(MyConfig)
+    config["signalCache"] = None
+    state = generate.makeJobState(config, seed, grid)
+    start = time.perf_counter()
+    if generate.isBatchSynth(state["synth"]):
+        generate.renderBatch(state, sampled)
+    else:
+        for jobIndex in sampled:
+            generate.renderBatch(state, [jobIndex])
+    return (time.perf_counter() - start)/len(sampled)
+
+def freeBytes(path):
+    '''Free space of the file system path will be on (its nearest existing parent)'''
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+def planRun(MyConfig, numTimed=5):
+    '''
+        Prints and returns (plan, problems) for a config: file count, audio-seconds and estimated bytes per record
+        format, the runtime extrapolated from numTimed synthesized jobs, free disk space, and the problems found
+        (missing keys, invalid synth_pnames, too little disk space). Nothing is written to outputpath.
+    '''
+    problems = ["config has no \"" + k + "\"" for k in REQUIRED_KEYS if not k in MyConfig]
+    if len(problems) > 0:
+        printPlan(None, problems)
+        return None, problems
+
+    seed = generate.DEFAULT_SEED
+    if "rngseed" in MyConfig and MyConfig["rngseed"] != None:
+        seed = MyConfig["rngseed"]
+    barsynth = validateSynth(MyConfig, seed, problems)
+
+    try:
+        grid = makeParamGrid(MyConfig, seed)
+    except (ValueError, KeyError) as e:
+        problems.append("cannot enumerate params: " + repr(e))
+        printPlan(None, problems)
+        return None, problems
+
+    examples = 1
+    if "examples" in MyConfig:
+        examples = MyConfig["examples"]
+    workers = 1
+    if "workers" in MyConfig and MyConfig["workers"] != None:
+        workers = max(1, MyConfig["workers"])
+    shardIndex = 0
+    numShards = 1
+    if "numShards" in MyConfig:
+        shardIndex = MyConfig["shardIndex"]
+        numShards = MyConfig["numShards"]
+
+    numChunks = MyConfig["numChunks"]
+    chunkSecs = MyConfig["soundDuration"]/numChunks
+    chunkSamples = math.floor(MyConfig["datafileSR"]*chunkSecs)
+    chunkStart, chunkEnd = shardRange(examples*len(grid)*numChunks, shardIndex, numShards)
+    jobs = range(chunkStart//numChunks, (chunkEnd+numChunks-1)//numChunks)
+    numRecords = chunkEnd - chunkStart
+
+    name = generate.chunkName(fileHandler(), MyConfig, grid, 0, 0, examples, 0) if len(grid) > 0 else MyConfig["soundname"]
+    userP, synthP = grid[0] if len(grid) > 0 else ((0,)*len(MyConfig["params"]), (0,)*len(MyConfig["params"]))
+    estimates = estimateOutputs(MyConfig, numRecords, chunkSamples, name, paramRecord(MyConfig, barsynth, name, userP, synthP, chunkSecs))
+
+    recordFormat = FORMAT_ALIASES.get(MyConfig["recordFormat"], MyConfig["recordFormat"])
+    if not recordFormat in estimates:
+        problems.append("unknown recordFormat " + str(MyConfig["recordFormat"]) + ", expected one of " + str(FORMATS))
+
+    secsPerJob = None
+    if barsynth != None:
+        try:
+            secsPerJob = timeJobs(MyConfig, seed, grid, jobs, numTimed)
+        except Exception as e:
+            problems.append("synthesis failed: " + repr(e))
+
+    plan = {
+        "paramSettings": len(grid),
+        "sampling": grid.mode,
+        "examples": examples,
+        "jobs": len(jobs),
+        "chunks": numRecords,
+        "chunkSecs": chunkSecs,
+        "audioSecs": numRecords*chunkSecs,
+        "recordFormat": recordFormat,
+        "formats": estimates,
+        "workers": workers,
+        "secsPerJob": secsPerJob,
+        "estimatedSecs": secsPerJob*len(jobs)/workers if secsPerJob != None else None,
+        "freeBytes": freeBytes(MyConfig["outputpath"]) if "outputpath" in MyConfig else None,
+    }
+    if recordFormat in estimates and plan["freeBytes"] != None and estimates[recordFormat]["bytes"] > plan["freeBytes"]:
+        problems.append("estimated {:.2f} GB for {} but only {:.2f} GB free at {}".format(estimates[recordFormat]["bytes"]/1e9,
+            recordFormat, plan["freeBytes"]/1e9, MyConfig["outputpath"]))
+    printPlan(plan, problems)
+    return plan, problems
+
+def printPlan(plan, problems):
+    if plan != None:
+        print("Plan:", plan["paramSettings"], "param settings (sampling: " + plan["sampling"] + ") x", plan["examples"], "examples =",
+            plan["jobs"], "synthesis jobs,", plan["chunks"], "chunks of", plan["chunkSecs"], "s")
+        print("Audio: {:.1f} s ({:.2f} h)".format(plan["audioSecs"], plan["audioSecs"]/3600))
+        for fmt in FORMATS:
+            estimate = plan["formats"][fmt]
+            print('  {} {:<10} {:>10} files {:>10.3f} GB (estimate)'.format("*" if fmt == plan["recordFormat"] else " ", fmt,
+                estimate["files"], estimate["bytes"]/1e9))
+        if plan["secsPerJob"] != None:
+            print("Synthesis: {:.3f} s per job, about {} with {} worker(s) (writing not included)".format(plan["secsPerJob"],
+                time.strftime("%H:%M:%S", time.gmtime(plan["estimatedSecs"])) if plan["estimatedSecs"] < 86400
+                else '{:.1f} days'.format(plan["estimatedSecs"]/86400), plan["workers"]))
+        if plan["freeBytes"] != None:
+            print("Free disk space: {:.2f} GB".format(plan["freeBytes"]/1e9))
+    if len(problems) > 0:
+        print("Problems:")
+        for problem in problems:
+            print("  -", problem)
+    else:
+        print("No problems found")
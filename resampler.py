@@ -0,0 +1,36 @@
+# Sample-rate conversion of synthesized signals.
+# The default backend is a rational-ratio polyphase resampler (NumPy/SciPy only) whose filter is designed once per SR pair.
+import math
+from functools import lru_cache
+
+from scipy import signal
+
+@lru_cache(maxsize=None)
+def polyphaseFilter(fromSR, toSR):
+    '''
+        Returns (up, down, h) for converting fromSR to toSR: the reduced up/down ratio and the anti-aliasing
+        low-pass FIR (the same design as scipy.signal.resample_poly's default), cached for the whole run.
+    '''
+    g = math.gcd(fromSR, toSR)
+    up = toSR//g
+    down = fromSR//g
+    maxRate = max(up, down)
+    halfLen = 10*maxRate
+    h = signal.firwin(2*halfLen+1, 1./maxRate, window=("kaiser", 5.0))
+    h.flags.writeable = False
+    return up, down, h
+
+def resample(sig, fromSR, toSR, backend="scipy"):
+    '''
+        Resamples sig from fromSR to toSR with the "scipy" (polyphase) or "librosa" backend.
+        sig is one signal or a 2-D batch with one signal per row; time is the last axis.
+    '''
+    if fromSR == toSR:
+        return sig
+    if backend == "librosa":
+        import librosa # conda install -c conda-forge librosa
+        return librosa.resample(sig, orig_sr=fromSR, target_sr=toSR, axis=-1)
+    if fromSR != int(fromSR) or toSR != int(toSR):
+        raise ValueError("polyphase resampling needs integer sample rates, got " + str(fromSR) + " and " + str(toSR))
+    up, down, h = polyphaseFilter(int(fromSR), int(toSR))
+    return signal.resample_poly(sig, up, down, axis=-1, window=h)
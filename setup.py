@@ -3,7 +3,7 @@ from distutils.core import setup
 setup(
     name='DSGenerator',
     version='0.1dev',
-    py_modules=['generate'],
+    py_modules=['generate', 'paramgrid', 'manifest', 'merge', 'nsjsonstream', 'tfshardwriter', 'outputpipeline', 'resampler', 'synthdataset', 'signalcache', 'arrayrecord', 'tarshards', 'metrics', 'benchmark', 'planner'],
     license='Creative Commons Attribution-Noncommercial-Share Alike license',
     long_description=open('README.md').read()
 )
\ No newline at end of file
@@ -0,0 +1,95 @@
+# Content-addressed on-disk cache of synthesized long signals.
+# Lets format, chunking and sample-rate changes be re-exported without re-synthesizing.
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+'''Default size bound of the cache directory, in bytes'''
+CACHE_BYTES = 10*1024*1024*1024
+
+def signalKey(synthHash, synthParams, seed, computeSR, duration):
+    '''
+        Cache key of a long signal: the synth module source hash, the full synth parameter vector
+        (a list of (synth_pname, value), swept and fixed), the job seed, computeSR and the duration.
+    '''
+    content = json.dumps([synthHash, [[p, float(v)] for p, v in synthParams], int(seed), computeSR, duration])
+    return hashlib.sha1(content.encode()).hexdigest()
+
+class signalCache():
+    '''
+        Directory of float32 .npy long signals named by key. Hits are returned memory-mapped and have their mtime
+        refreshed, so that eviction (oldest mtime first, once the directory exceeds maxBytes) is least-recently-used.
+        Entries are written to a temporary file and renamed, so concurrent workers never see partial entries.
+    '''
+
+    def __init__(self, cachedir, maxBytes=CACHE_BYTES):
+
+        self.cachedir = cachedir
+        self.maxBytes = maxBytes
+        os.makedirs(cachedir, exist_ok=True)
+        '''Running estimate of the directory size, re-measured whenever eviction runs'''
+        self.size = sum(size for _, size, _ in self.__entries__())
+        '''A cache opened with a smaller bound shrinks right away, even if the run only gets hits'''
+        if self.size > self.maxBytes:
+            self.evict()
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key + ".npy")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            sig = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            '''Missing, or evicted/replaced meanwhile'''
+            return None
+        return sig
+
+    def put(self, key, sig):
+        '''Stores sig as float32 and returns the stored (memory-mapped) signal'''
+        sig = np.asarray(sig, dtype=np.float32)
+        fd, tmppath = tempfile.mkstemp(dir=self.cachedir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, sig)
+            os.replace(tmppath, self.path(key))
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        self.size = self.size + os.path.getsize(self.path(key))
+        if self.size > self.maxBytes:
+            self.evict()
+        stored = self.get(key)
+        return sig if stored is None else stored
+
+    def evict(self):
+        '''Removes least recently used entries until the cache fits in maxBytes'''
+        entries = sorted(self.__entries__())
+        self.size = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if self.size <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                '''Evicted by another worker'''
+                pass
+            self.size = self.size - size
+
+    def __entries__(self):
+        '''(mtime, size, path) of the cache entries'''
+        entries = []
+        for e in os.scandir(self.cachedir):
+            if not e.name.endswith(".npy"):
+                continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
@@ -0,0 +1,94 @@
+# On-the-fly dataset: synthesizes samples by index from a generator config, without writing any files.
+import collections
+import multiprocessing
+
+import generate
+from paramgrid import makeParamGrid
+
+class synthDataset():
+    '''
+        Map-style dataset over the (example x combination x chunk) space of a config, as enumerated by generate().
+        ds[i] returns (audio_chunk, user_params, synth_params) for flat chunk index i. Each job is regenerated from
+        the run seed, its example number and its param setting (generate.jobSeed), so ds[i] is the chunk a generate() run with the same config and seed writes.
+        The chunked long signals of the cacheSize most recently used jobs are kept (LRU), so the sibling chunks
+        of a combination are served without re-synthesis.
+        The synth module is loaded with loadSoundModels, i.e. from the current directory.
+    '''
+
+    def __init__(self, MyConfig, cacheSize=8):
+
+        self.config = MyConfig
+        generate.loadSoundModels(MyConfig)
+        self.seed = generate.baseSeed(MyConfig)
+        self.grid = makeParamGrid(MyConfig, self.seed)
+        self.numChunks = MyConfig["numChunks"]
+        self.examples = 1
+        if "examples" in MyConfig:
+            self.examples = MyConfig["examples"]
+
+        self.state = generate.makeJobState(MyConfig, self.seed, self.grid)
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()
+
+    def __len__(self):
+        return self.examples*len(self.grid)*self.numChunks
+
+    def __getitem__(self, i):
+        if i < 0:
+            i = i + len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("dataset index out of range")
+        jobIndex, chnk = divmod(i, self.numChunks)
+        synthVals, chunks = self.job(jobIndex)
+        userP = self.grid[jobIndex % len(self.grid)][0]
+        return chunks[chnk], userP, synthVals
+
+    def __iter__(self):
+        return self.iterate()
+
+    def job(self, jobIndex):
+        '''Returns (synthVals, chunks) of a job, from the cache or freshly synthesized'''
+        if jobIndex in self.cache:
+            self.cache.move_to_end(jobIndex)
+            return self.cache[jobIndex]
+        _, synthVals, chunks = generate.renderBatch(self.state, [jobIndex])[0]
+        self.__cacheJob__(jobIndex, (synthVals, chunks))
+        return synthVals, chunks
+
+    def __cacheJob__(self, jobIndex, entry):
+        if self.cacheSize <= 0:
+            return
+        self.cache[jobIndex] = entry
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    def __jobSamples__(self, jobIndex, synthVals, chunks, start, stop):
+        userP = self.grid[jobIndex % len(self.grid)][0]
+        for chnk in range(self.numChunks):
+            if start <= jobIndex*self.numChunks + chnk < stop:
+                yield chunks[chnk], userP, synthVals
+
+    def iterate(self, start=0, stop=None, workers=0, prefetch=None):
+        '''
+            Yields the samples [start, stop) in index order. With workers > 0, jobs are synthesized by a process pool,
+            keeping up to prefetch jobs (default 2 per worker) in flight ahead of the consumer.
+        '''
+        if stop == None or stop > len(self):
+            stop = len(self)
+        jobs = range(start//self.numChunks, (stop+self.numChunks-1)//self.numChunks)
+
+        if workers <= 0:
+            for jobIndex in jobs:
+                synthVals, chunks = self.job(jobIndex)
+                yield from self.__jobSamples__(jobIndex, synthVals, chunks, start, stop)
+            return
+
+        if prefetch == None:
+            prefetch = 2*workers
+        pool = multiprocessing.Pool(workers, initializer=generate.initWorker, initargs=(self.config, self.seed, self.grid))
+        try:
+            for jobIndex, synthVals, chunks in generate.imapBounded(pool, generate.synthesizeJob, jobs, prefetch):
+                yield from self.__jobSamples__(jobIndex, synthVals, chunks, start, stop)
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,90 @@
+# Tar-shard ("tarshards") output: sequential, append-only tar files in the WebDataset layout.
+# Each chunk is stored as <key>.wav and <key>.json; no TensorFlow needed, and far fewer files than one pair per chunk.
+import glob
+import io
+import json
+import os
+import re
+import tarfile
+
+'''Default target size of a tar shard, in bytes'''
+TARSHARD_BYTES = 100*1024*1024
+
+def tarKey(name):
+    '''WebDataset keys end at the first dot, so the dots of formatted param values are replaced'''
+    return name.replace(".", "_")
+
+class tarShardWriter():
+    '''
+        Streams chunk members into tarshard<suffix>-NNNNN.tar files, starting a new shard once the current one
+        reaches shardBytes, and keeps the shard list in tarshards<suffix>.json (rewritten as each shard closes).
+        Each add() carries a tag, handed back by completed() once its shard is closed (and its size final).
+        With resume, shards listed in an existing index are kept and numbering continues after them.
+    '''
+
+    def __init__(self, outputpath, suffix="", shardBytes=TARSHARD_BYTES, resume=False):
+
+        self.outputpath = outputpath
+        self.prefix = "tarshard" + suffix
+        self.shardBytes = shardBytes
+        self.indexPath = os.path.join(outputpath, "tarshards" + suffix + ".json")
+
+        self.shards = []
+        if resume and os.path.isfile(self.indexPath):
+            with open(self.indexPath) as f:
+                self.shards = json.load(f)["shards"]
+        else:
+            '''A fresh run replaces the shards of earlier runs'''
+            for path in glob.glob(os.path.join(outputpath, self.prefix + "-[0-9]*.tar")):
+                os.remove(path)
+        self.shardNum = 0
+        for shard in self.shards:
+            self.shardNum = max(self.shardNum, int(re.search(r"-(\d+)\.tar$", shard["file"]).group(1)) + 1)
+
+        self.tar = None
+        self.keys = []
+        self.tags = []
+        self.done = []
+
+    def shardPath(self):
+        return os.path.join(self.outputpath, self.prefix + '-{:05}.tar'.format(self.shardNum))
+
+    def add(self, tag, name, wavBytes, record):
+        if self.tar == None:
+            self.tar = tarfile.open(self.shardPath(), "w")
+        key = tarKey(name)
+        self.__addMember__(key + ".wav", wavBytes)
+        self.__addMember__(key + ".json", json.dumps(record, default=float).encode())
+        self.keys.append(key)
+        self.tags.append(tag)
+        if self.tar.fileobj.tell() >= self.shardBytes:
+            self.__closeShard__()
+
+    def completed(self):
+        '''Returns (and forgets) the (tag, shard path) pairs of the chunks in shards closed since the last call'''
+        done = self.done
+        self.done = []
+        return done
+
+    def close(self):
+        self.__closeShard__()
+
+    def __addMember__(self, name, data):
+        '''Members keep the default zero mtime, so shards are reproducible byte for byte'''
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def __closeShard__(self):
+        if self.tar == None:
+            return
+        path = self.shardPath()
+        self.tar.close()
+        self.tar = None
+        self.shards.append({"file": os.path.basename(path), "keys": self.keys, "bytes": os.path.getsize(path)})
+        with open(self.indexPath, "w") as f:
+            json.dump({"shards": self.shards}, f)
+        self.done.extend((tag, path) for tag in self.tags)
+        self.shardNum += 1
+        self.keys = []
+        self.tags = []
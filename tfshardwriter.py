@@ -0,0 +1,153 @@
+# Background tfrecord shard writer.
+# Shards are cut by (estimated) serialized size and written by a thread, so synthesis and serialization overlap.
+import contextlib
+import os
+import queue
+import threading
+
+'''Default target size of a tfrecord shard, in bytes'''
+SHARD_BYTES = 100*1024*1024
+
+def recordBytes(nameLength, numSamples, numParams):
+    '''Estimated serialized size of one record: float32 audio samples, its name and the param values'''
+    return 4*numSamples + nameLength + 16*numParams
+
+def configShardBytes(MyConfig, nameLength, numSamples):
+    '''
+        Shard size in bytes of a config: "shard_bytes", or the legacy "shard_size" (records per shard) times
+        the estimated record size, or SHARD_BYTES
+    '''
+    if "shard_bytes" in MyConfig:
+        return MyConfig["shard_bytes"]
+    if "shard_size" in MyConfig:
+        return MyConfig["shard_size"]*recordBytes(nameLength, numSamples, len(MyConfig["params"]) + len(MyConfig["fixedParams"]))
+    return SHARD_BYTES
+
+def configShardRecords(MyConfig):
+    '''Records per shard of a config with the legacy "shard_size" (and no "shard_bytes"), otherwise None'''
+    if "shard_size" in MyConfig and not "shard_bytes" in MyConfig:
+        print("\"shard_size\" is deprecated, use \"shard_bytes\"; cutting shards every", MyConfig["shard_size"], "records")
+        return MyConfig["shard_size"]
+    return None
+
+def tfrecordPath(pfName):
+    '''tfrecord file written for one chunk with "tftype": "single" (the .params name with a .tfrecord extension)'''
+    return os.path.splitext(pfName)[0] + ".tfrecord"
+
+def tfrecordFiles(dirs):
+    '''Modification time and size of the .tfrecord files directly in dirs, by path'''
+    files = {}
+    for d in dirs:
+        try:
+            entries = list(os.scandir(d))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.endswith(".tfrecord") and entry.is_file():
+                stat = entry.stat()
+                files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+class tfShardWriter():
+    '''
+        Collects chunk records into a shard until its estimated size reaches shardBytes (or, with shardRecords,
+        until it holds shardRecords records, for legacy "shard_size" configs), then hands the full shard
+        to a writer thread (tfrecordManager.__tfwriteN__). A new shard is only handed over once the previous one
+        is written, so at most two shards (one filling, one being written) are held in memory.
+        Errors of the writer thread are raised from the next add() or from close(). The tfrecord files a shard
+        wrote are found as the .tfrecord files that appeared or changed in outputpath (and in the directory of
+        its first record) during the write, and handed back with its pfnames by completed().
+        With a metrics.runMetrics instance, shard serialization is timed as the "tfrecordsWrite" stage.
+    '''
+
+    def __init__(self, tfr, outputpath, paramArr, fixedParams, shardBytes=SHARD_BYTES, metrics=None, shardRecords=None):
+
+        self.tfr = tfr
+        self.outputpath = outputpath
+        self.paramArr = paramArr
+        self.fixedParams = fixedParams
+        self.shardBytes = shardBytes
+        self.shardRecords = shardRecords
+        self.metrics = metrics
+
+        self.__newShard__()
+        self.written = []
+        self.lock = threading.Lock()
+        self.error = None
+
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def __newShard__(self):
+        self.shard = {"pfnames": [], "soundDurations": [], "segmentNum": [], "audioSegments": [], "usertfP": [], "synthtfP": []}
+        self.shardSize = 0
+
+    def recordBytes(self, pfName, sig):
+        return recordBytes(len(pfName), len(sig), len(self.paramArr) + len(self.fixedParams))
+
+    def add(self, pfName, soundDuration, sig, chnk, userP, synthP):
+        self.__checkError__()
+        size = self.recordBytes(pfName, sig)
+        if self.shardRecords != None:
+            full = len(self.shard["pfnames"]) >= self.shardRecords
+        else:
+            full = self.shardSize > 0 and self.shardSize + size > self.shardBytes
+        if full:
+            self.flush()
+        self.shard["pfnames"].append(pfName)
+        self.shard["soundDurations"].append(soundDuration)
+        self.shard["segmentNum"].append(chnk)
+        self.shard["audioSegments"].append(sig)
+        self.shard["usertfP"].append(userP)
+        self.shard["synthtfP"].append(synthP)
+        self.shardSize = self.shardSize + size
+
+    def flush(self):
+        '''Hands the current shard to the writer thread, after the previous shard has been written'''
+        if len(self.shard["pfnames"]) == 0:
+            return
+        self.queue.join()
+        self.__checkError__()
+        self.queue.put(self.shard)
+        self.__newShard__()
+
+    def completed(self):
+        '''Returns (and forgets) the (pfnames, tfrecord files) of the shards written since the last call'''
+        with self.lock:
+            written = self.written
+            self.written = []
+        return written
+
+    def close(self):
+        '''Writes the final partial shard and waits for the writer thread'''
+        self.flush()
+        self.queue.join()
+        self.queue.put(None)
+        self.thread.join()
+        self.__checkError__()
+
+    def __checkError__(self):
+        if self.error != None:
+            raise RuntimeError("tfrecord shard writer failed") from self.error
+
+    def __run__(self):
+        while True:
+            shard = self.queue.get()
+            if shard == None:
+                self.queue.task_done()
+                return
+            try:
+                if self.error == None:
+                    dirs = {self.outputpath, os.path.dirname(shard["pfnames"][0])}
+                    before = tfrecordFiles(dirs)
+                    with self.metrics.stage("tfrecordsWrite") if self.metrics != None else contextlib.nullcontext():
+                        self.tfr.__tfwriteN__(self.outputpath, shard["pfnames"], shard["soundDurations"], shard["segmentNum"],
+                            shard["audioSegments"], shard["usertfP"], shard["synthtfP"], self.paramArr, self.fixedParams)
+                    files = sorted(p for p, stat in tfrecordFiles(dirs).items() if before.get(p) != stat)
+                    with self.lock:
+                        self.written.append((shard["pfnames"], files))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()